@@ -48,6 +48,11 @@ data class NaraGaidenFetchResult(
 )
 
 object NaraGaidenApi {
+    // Last response and its ETag, so unchanged data comes back as a bodiless
+    // 304; its X-Nara-Generated-At header still moves "as of" forward.
+    @Volatile
+    private var cached: Pair<String, NaraGaidenFetchResult>? = null
+
     fun fetch(): NaraGaidenFetchResult {
         val url = URL(NaraGaidenConfig.serverUrl)
         val connection = url.openConnection() as HttpURLConnection
@@ -55,8 +60,17 @@ object NaraGaidenApi {
         connection.readTimeout = 15000
         connection.requestMethod = "GET"
         connection.setRequestProperty("Accept", "application/json")
+        val previous = cached
+        if (previous != null) {
+            connection.setRequestProperty("If-None-Match", previous.first)
+        }
 
         val responseCode = connection.responseCode
+        if (responseCode == HttpURLConnection.HTTP_NOT_MODIFIED && previous != null) {
+            val generatedAt = connection.getHeaderField("X-Nara-Generated-At")?.toLongOrNull()
+                ?: return previous.second
+            return previous.second.copy(updatedLine = formatUpdated(generatedAt))
+        }
         if (responseCode != 200) {
             throw IOException("HTTP $responseCode")
         }
@@ -64,10 +78,13 @@ object NaraGaidenApi {
         val body = connection.inputStream.bufferedReader().use { it.readText() }
         val json = JSONObject(body)
         val generatedAt = json.optLong("generatedAt", 0L)
-        return NaraGaidenFetchResult(
+        val result = NaraGaidenFetchResult(
             json = body,
             updatedLine = formatUpdated(generatedAt)
         )
+        val etag = connection.getHeaderField("ETag")
+        cached = if (etag != null) Pair(etag, result) else null
+        return result
     }
 
     private fun formatUpdated(generatedAt: Long): String {
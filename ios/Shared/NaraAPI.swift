@@ -87,15 +87,46 @@ struct NaraEvent: Codable {
     }
 }
 
+private final class NaraResponseCache: @unchecked Sendable {
+    private let lock = NSLock()
+    private var entry: (etag: String, payload: NaraPayload)?
+
+    var value: (etag: String, payload: NaraPayload)? {
+        get { lock.withLock { entry } }
+        set { lock.withLock { entry = newValue } }
+    }
+}
+
 enum NaraAPI {
+    // Last payload and its ETag, so unchanged data comes back as a bodiless
+    // 304; its X-Nara-Generated-At header still moves "as of" forward.
+    private static let cache = NaraResponseCache()
+
     static func fetch() async throws -> NaraPayload {
         var request = URLRequest(url: NaraConfig.serverURL)
         request.cachePolicy = .reloadIgnoringLocalCacheData
         request.timeoutInterval = 15
+        let previous = cache.value
+        if let previous {
+            request.setValue(previous.etag, forHTTPHeaderField: "If-None-Match")
+        }
         let (data, response) = try await URLSession.shared.data(for: request)
+        if let http = response as? HTTPURLResponse, http.statusCode == 304, let previous {
+            guard let header = http.value(forHTTPHeaderField: "X-Nara-Generated-At"),
+                  let generatedAt = Int64(header) else {
+                return previous.payload
+            }
+            return NaraPayload(generatedAt: generatedAt, children: previous.payload.children)
+        }
         if let http = response as? HTTPURLResponse, http.statusCode != 200 {
             throw URLError(.badServerResponse)
         }
-        return try JSONDecoder().decode(NaraPayload.self, from: data)
+        let payload = try JSONDecoder().decode(NaraPayload.self, from: data)
+        if let http = response as? HTTPURLResponse, let etag = http.value(forHTTPHeaderField: "ETag") {
+            cache.value = (etag, payload)
+        } else {
+            cache.value = nil
+        }
+        return payload
     }
 }
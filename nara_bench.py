@@ -0,0 +1,420 @@
+# usage: python nara_bench.py [--events 1000,1000000] [--children 1,8] [--baseline nara_bench_baseline.json]
+
+import argparse
+import gc
+import http.client
+import json
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from pathlib import Path
+
+import nara_live_export
+from nara_live_export import (
+    REMOTE_FIREBASE_DB,
+    REMOTE_NARA_DB,
+    TRACKZ_COLUMNS,
+    LiveCollector,
+    collect_live_data,
+    parse_duration,
+)
+from nara_metrics import resident_memory_bytes
+from nara_web import Handler, build_html, build_index, build_json, latest_by_group, make_server, vitamins_today
+
+FAMILY_KEY = "family0"
+USER_KEYS = ("user0", "user1")
+ROUTINE_NAMES = ("Vitamin D", "Bath", "Tummy time", "Medicine")
+DIAPER_DETAILS = (None, None, "Blowout")
+DIRTY_COLORS = ("yellow", "brown", "green")
+
+
+def synthetic_payload(rng, track_type, user_key):
+    payload = {"createUserKey": user_key, "timezone": "America/New_York", "isTimer": False}
+    if track_type == "FEED.BOTTLE":
+        payload.update(
+            bottleFormulaVolumeNum=rng.choice((60, 90, 120, 1500)),
+            bottleFormulaVolumeExp=rng.choice((0, 0, 0, 1)),
+            bottleFormulaVolumeUnit="ml",
+            bottleBreastMilkVolumeNum=rng.choice((0, 30, 60)),
+            bottleBreastMilkVolumeExp=0,
+            bottleVolumeUnit="ml",
+        )
+        if rng.random() < 0.5:
+            payload["formulaName"] = "Similac 360"
+    elif track_type == "FEED.BREAST":
+        payload.update(
+            breastLeftDuration=rng.randrange(0, 20) * 60000,
+            breastRightDuration=rng.randrange(0, 20) * 60000,
+            breastLastSide=rng.choice(("LEFT", "RIGHT")),
+        )
+    elif track_type == "DIAPER.DIAPER":
+        pee = rng.random() < 0.8
+        poop = rng.random() < 0.4
+        payload.update(diaperTypePee=pee, diaperTypePoop=poop, diaperTypeDry=not (pee or poop))
+        if poop:
+            payload.update(diaperDirtyColor=rng.choice(DIRTY_COLORS), diaperDirtyTexture="seedy")
+        detail = rng.choice(DIAPER_DETAILS)
+        if detail:
+            payload["diaperDetail"] = detail
+    else:
+        payload.update(routineName=rng.choice(ROUTINE_NAMES), routineKey=f"routine{rng.randrange(4)}")
+    return payload
+
+
+def shift_to_now(nara_path):
+    # Timestamps count back from when the file was generated; a reused file
+    # is moved up to now so the --since window and "today" cover the same
+    # events on every run.  Returns False for files from before benchMeta.
+    con = sqlite3.connect(nara_path)
+    try:
+        try:
+            row = con.execute("SELECT value FROM benchMeta WHERE name = 'generatedAt'").fetchone()
+        except sqlite3.OperationalError:
+            return False
+        if row is None:
+            return False
+        shift = int(time.time() * 1000) - int(row[0])
+        with con:
+            con.execute(
+                "UPDATE trackz SET beginDt = beginDt + ?1, endDt = endDt + ?1, updateDt = updateDt + ?1", (shift,)
+            )
+            con.execute("UPDATE benchMeta SET value = value + ? WHERE name = 'generatedAt'", (shift,))
+        return True
+    finally:
+        con.close()
+
+
+def make_synthetic_db(directory, events, children, seed=0):
+    # A trackz table shaped like the app's, one event every few minutes per
+    # child going back from now, plus the Firebase serverCache name entries.
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    nara_path = directory / "nara.db"
+    firebase_path = directory / "amazing-ripple-221320.firebaseio.com_default"
+    if nara_path.exists() and firebase_path.exists() and shift_to_now(nara_path):
+        return nara_path, firebase_path
+
+    rng = random.Random(seed)
+    child_keys = [f"child{i}" for i in range(children)]
+    step_ms = max(1, 20 * 60 * 1000 // children)
+    now_ms = int(time.time() * 1000)
+    tmp_path = directory / "nara.db.tmp"
+    tmp_path.unlink(missing_ok=True)
+    con = sqlite3.connect(tmp_path)
+    con.execute(
+        "CREATE TABLE trackz (key TEXT PRIMARY KEY, etag TEXT, updateDt INTEGER, json TEXT, beginDt INTEGER,"
+        " endDt INTEGER, familyKey TEXT, childKey TEXT, trackGroupKey TEXT, trackTypeKey TEXT,"
+        " formulaName TEXT, medicineName TEXT, note TEXT)"
+    )
+    insert = f"INSERT INTO trackz ({TRACKZ_COLUMNS}) VALUES ({','.join('?' * 13)})"
+    rows = []
+    for i in range(events):
+        begin = now_ms - i * step_ms - rng.randrange(step_ms)
+        group = rng.choices(("FEED", "DIAPER", "ROUTINE"), (5, 4, 1))[0]
+        track_type = {
+            "FEED": rng.choice(("FEED.BOTTLE", "FEED.BREAST")),
+            "DIAPER": "DIAPER.DIAPER",
+            "ROUTINE": "ROUTINE.ROUTINE",
+        }[group]
+        payload = synthetic_payload(rng, track_type, rng.choice(USER_KEYS))
+        note = "fussy" if rng.random() < 0.05 else None
+        rows.append(
+            (
+                f"-N{i:09d}",
+                f"etag{i}",
+                begin + rng.randrange(60000),
+                json.dumps(payload),
+                begin,
+                begin + rng.randrange(20 * 60000),
+                FAMILY_KEY,
+                child_keys[i % children],
+                group,
+                track_type,
+                payload.get("formulaName"),
+                None,
+                note,
+            )
+        )
+        if len(rows) >= 10000:
+            con.executemany(insert, rows)
+            rows = []
+    con.executemany(insert, rows)
+    con.execute("CREATE TABLE benchMeta (name TEXT PRIMARY KEY, value INTEGER)")
+    con.execute("INSERT INTO benchMeta VALUES ('generatedAt', ?)", (now_ms,))
+    con.commit()
+    con.close()
+
+    con = sqlite3.connect(firebase_path)
+    con.execute("CREATE TABLE IF NOT EXISTS serverCache (path TEXT PRIMARY KEY, value BLOB)")
+    names = {key: {"name": f"Baby {key[5:]}", "birthDt": now_ms - 200 * 86400000} for key in child_keys}
+    con.execute(
+        "INSERT OR REPLACE INTO serverCache VALUES (?, ?)",
+        (f"/familyz/{FAMILY_KEY}/childz/", json.dumps(names).encode()),
+    )
+    for user_key in USER_KEYS:
+        con.execute(
+            "INSERT OR REPLACE INTO serverCache VALUES (?, ?)",
+            (f"/userz/{user_key}/_/", json.dumps({"name": user_key.title()}).encode()),
+        )
+    con.commit()
+    con.close()
+    os.replace(tmp_path, nara_path)
+    return nara_path, firebase_path
+
+
+def measure(fn, repeat):
+    # Best per-call time, looping fast functions like timeit so that each
+    # sample is long enough to be stable.
+    result = fn()
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number, result
+
+
+def calibrate(repeat):
+    # A fixed workload (JSON, sorting, SQLite) timed around every size's
+    # benchmarks; comparing each benchmark relative to it cancels out how
+    # fast the machine is, and was while that size ran.
+    rng = random.Random(0)
+    rows = [{"key": f"k{i}", "beginDt": rng.randrange(1 << 40), "note": "x" * rng.randrange(20)} for i in range(20000)]
+
+    def workload():
+        text = json.dumps(sorted(rows, key=lambda row: row["beginDt"]))
+        con = sqlite3.connect(":memory:")
+        con.execute("CREATE TABLE t (key TEXT PRIMARY KEY, beginDt INTEGER, note TEXT)")
+        con.executemany("INSERT INTO t VALUES (:key, :beginDt, :note)", json.loads(text))
+        con.execute("SELECT COUNT(*) FROM t WHERE beginDt > ?", (1 << 39,)).fetchone()
+        con.close()
+
+    return measure(workload, repeat)[0]
+
+
+def peak_memory(fn):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class QuietHandler(Handler):
+    def log_message(self, format, *args):
+        pass
+
+
+def stub_adb(sources):
+    # Stands in for adb: "pulls" copy the synthetic files, there is never a
+    # -wal, and no remote signature so every refresh pulls.
+    def adb_pull(adb_path, remote, local, adb_device=None, retries=2, retry_delay=0.5, client=None):
+        if remote not in sources:
+            raise RuntimeError(f"remote object '{remote}' does not exist")
+        shutil.copyfile(sources[remote], local)
+
+    nara_live_export.adb_pull = adb_pull
+    nara_live_export.remote_signature = lambda *args, **kwargs: None
+
+
+def bench_requests(server, path, requests, repeat=1):
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conn = http.client.HTTPConnection(*server.server_address[:2])
+
+    def get():
+        conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+            raise RuntimeError(f"GET {path}: HTTP {response.status}")
+
+    try:
+        get()
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(requests):
+                get()
+            seconds = (time.perf_counter() - start) / requests
+            best = seconds if best is None else min(best, seconds)
+        return best
+    finally:
+        conn.close()
+        server.shutdown()
+        server.server_close()
+
+
+def run_size(data_dir, events, children, repeat, requests, memory):
+    nara_path, firebase_path = make_synthetic_db(data_dir / f"{events}x{children}", events, children)
+    calibration = calibrate(repeat)
+    results = {}
+
+    def record(name, fn, count):
+        seconds, result = measure(fn, repeat)
+        entry = {"seconds": seconds, "per_second": count / seconds if seconds else None}
+        if memory:
+            entry["peak_bytes"] = peak_memory(fn)
+        results[f"{name}[{events}x{children}]"] = entry
+        return result
+
+    data = record("collect_live_data", lambda: collect_live_data(nara_path, firebase_path), events)
+    event_list = data["events"]
+
+    def collect_incremental():
+        collector = LiveCollector()
+        collector.collect(nara_path, firebase_path)
+        return collector
+
+    collector = record("LiveCollector.collect", collect_incremental, events)
+    record("LiveCollector.collect_unchanged", lambda: collector.collect(nara_path, firebase_path), 1)
+    latest_feed = record("latest_by_group", lambda: latest_by_group(event_list, "FEED"), events)
+    vitamins = record("vitamins_today", lambda: vitamins_today(event_list), events)
+    index = build_index(event_list)
+    latest_diaper = index["DIAPER"]
+    generated_at = data["generatedAt"]
+    children_map = data["children"]
+    record(
+        "build_json",
+        lambda: json.dumps(build_json(latest_feed, latest_diaper, children_map, generated_at, vitamins)),
+        children,
+    )
+    record("build_html", lambda: build_html(latest_feed, latest_diaper, children_map, generated_at, "", vitamins), children)
+
+    stub_adb({REMOTE_NARA_DB: nara_path, REMOTE_FIREBASE_DB: firebase_path})
+    for name, ttl, count in (("GET /json (refresh)", 0.0, max(1, requests // 10)), ("GET /json (cached)", 3600.0, requests)):
+        with tempfile.TemporaryDirectory(prefix="nara_bench_") as db_dir:
+            server = make_server("127.0.0.1", 0, db_dir, since_ms=parse_duration("48h"), cache_ttl=ttl)
+            server.RequestHandlerClass = QuietHandler
+            seconds = bench_requests(server, "/json", count, repeat)
+        results[f"{name}[{events}x{children}]"] = {"seconds": seconds, "per_second": 1 / seconds}
+    calibration = min(calibration, calibrate(repeat))
+    results[f"calibration[{events}x{children}]"] = {"seconds": calibration, "per_second": None}
+    return results
+
+
+def compare(results, baseline, tolerance, overall_tolerance, min_seconds=0.0):
+    # Ratios are scaled by how the calibration of the same size compares
+    # with the baseline's.  Benchmarks under min_seconds, in either run, are shown
+    # but don't gate: at that size scheduling noise outweighs the code.
+    # Single benchmarks only fail on a gross slowdown; the geometric mean of
+    # the rest, where noise averages out, catches smaller broad ones.
+    regressions = []
+    gated = []
+    for name, entry in results.items():
+        base = baseline.get(name)
+        size = name[name.rindex("["):]
+        current_calibration = results.get(f"calibration{size}")
+        base_calibration = baseline.get(f"calibration{size}")
+        if not base or not base.get("seconds") or name.startswith("calibration"):
+            continue
+        speed = 1.0
+        if current_calibration and base_calibration:
+            speed = current_calibration["seconds"] / base_calibration["seconds"]
+        ratio = entry["seconds"] / base["seconds"] / speed
+        entry["baseline_ratio"] = ratio
+        if min(entry["seconds"], base["seconds"]) < min_seconds:
+            continue
+        gated.append(ratio)
+        if ratio > 1 + tolerance:
+            regressions.append((name, ratio))
+    overall = math.exp(sum(map(math.log, gated)) / len(gated)) if gated else None
+    if overall is not None and overall > 1 + overall_tolerance:
+        regressions.append(("overall (geometric mean)", overall))
+    return regressions, overall
+
+
+def format_bytes(value):
+    if value is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or unit == "GiB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+
+
+def print_results(results):
+    print(f"{'benchmark':<52} {'time':>11} {'items/s':>12} {'peak mem':>11} {'vs base':>8}")
+    for name, entry in results.items():
+        per_second = entry.get("per_second")
+        ratio = entry.get("baseline_ratio")
+        print(
+            f"{name:<52} {entry['seconds'] * 1000:>9.3f}ms"
+            f" {f'{per_second:,.0f}' if per_second else '-':>12}"
+            f" {format_bytes(entry.get('peak_bytes')):>11}"
+            f" {f'{ratio:.2f}x' if ratio else '-':>8}"
+        )
+
+
+def parse_sizes(value):
+    return [int(part) for part in value.split(",") if part.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", dest="events", type=parse_sizes, default="1000,10000,100000", help="comma-separated sizes, up to 1000000")
+    parser.add_argument("--children", dest="children", type=parse_sizes, default="1,8", help="comma-separated child counts, 1 to 8")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=5)
+    parser.add_argument("--requests", dest="requests", type=int, default=200)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip the tracemalloc peak-memory pass")
+    parser.add_argument(
+        "--data-dir",
+        dest="data_dir",
+        default=os.environ.get("NARA_BENCH_DIR", str(Path(tempfile.gettempdir()) / "nara_bench")),
+        help="where synthetic databases are generated and reused",
+    )
+    parser.add_argument("--baseline", dest="baseline", default=None, help="compare against this results file")
+    parser.add_argument("--save", dest="save", default=None, help="write results to this file (e.g. a new baseline)")
+    parser.add_argument("--tolerance", dest="tolerance", type=float, default=1.0, help="allowed slowdown of any one benchmark vs baseline")
+    parser.add_argument(
+        "--overall-tolerance",
+        dest="overall_tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown of the geometric mean over all checked benchmarks",
+    )
+    parser.add_argument(
+        "--min-time",
+        dest="min_time",
+        type=float,
+        default=0.005,
+        help="benchmarks faster than this many seconds are reported but not checked against the baseline",
+    )
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    results = {}
+    for events in args.events:
+        for children in args.children:
+            print(f"running {events} events x {children} children...", file=sys.stderr)
+            results.update(run_size(data_dir, events, children, args.repeat, args.requests, args.memory))
+
+    regressions = []
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions, overall = compare(
+            results, baseline.get("results", baseline), args.tolerance, args.overall_tolerance, args.min_time
+        )
+        if overall is not None:
+            print(f"overall vs baseline: {overall:.2f}x", file=sys.stderr)
+    print_results(results)
+    rss = resident_memory_bytes()
+    print(f"process RSS: {format_bytes(rss)}")
+    if args.save:
+        out = {"python": sys.version.split()[0], "platform": sys.platform, "results": results}
+        Path(args.save).write_text(json.dumps(out, indent=2, sort_keys=True))
+    for name, ratio in regressions:
+        print(f"REGRESSION: {name} is {ratio:.2f}x the baseline time (speed-adjusted)", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
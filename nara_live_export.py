@@ -1,34 +1,182 @@
 import argparse
+import hashlib
 import json
+import math
 import os
+import shlex
+import shutil
+import socket
 import sqlite3
+import struct
 import subprocess
+import sys
+import threading
 import time
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Mapping
+from contextlib import ExitStack, contextmanager
+from itertools import islice
 from pathlib import Path
 
+from nara_metrics import Counter, Histogram
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+
+        json_loads = ujson.loads
+    except ImportError:
+        json_loads = json.loads
+
 
 REMOTE_NARA_DB = "/data/data/com.naraorganics.nara/no_backup/NaraSqlite/nara.db"
 REMOTE_FIREBASE_DB = "/data/data/com.naraorganics.nara/databases/amazing-ripple-221320.firebaseio.com_default"
 
+TRACKZ_COLUMNS = "key, etag, updateDt, json, beginDt, endDt, familyKey, childKey, trackGroupKey, trackTypeKey, formulaName, medicineName, note"
+TRACKZ_COLUMN_COUNT = len(TRACKZ_COLUMNS.split(","))
+TRACKZ_INDEXES = "CREATE INDEX IF NOT EXISTS gaiden_trackz_latest ON trackz (childKey, trackGroupKey, beginDt);"
+# Only worth it where the table persists between refreshes: on a freshly
+# pulled copy, building it costs more than the watermark scan it saves.
+TRACKZ_UPDATE_INDEX = "CREATE INDEX IF NOT EXISTS gaiden_trackz_updated ON trackz (updateDt);"
+
+
+ADB_PULL_SECONDS = Histogram("nara_adb_pull_seconds", "Time per adb pull attempt.")
+ADB_PULL_RETRIES = Counter("nara_adb_pull_retries_total", "adb pull attempts after a failed one.")
+COLLECT_SECONDS = Histogram("nara_collect_seconds", "LiveCollector.collect time by phase.")
+
 
-def run(cmd):
-    result = subprocess.run(cmd, capture_output=True, text=True)
+# A hung adb (e.g. a wedged emulator) would otherwise block its caller forever.
+ADB_TIMEOUT = float(os.environ.get("NARA_ADB_TIMEOUT", "120"))
+
+
+def run(cmd, timeout=None):
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout or ADB_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"{cmd[0]} timed out after {timeout or ADB_TIMEOUT:g}s") from None
     if result.returncode != 0:
         raise RuntimeError(result.stderr.strip() or result.stdout.strip() or "command failed")
     return result.stdout
 
 
-def adb_pull(adb_path, remote, local, adb_device=None, retries=2, retry_delay=0.5):
+def adb_command(adb_path, adb_device=None):
     cmd = [adb_path]
     if adb_device:
         cmd.extend(["-s", adb_device])
+    return cmd
+
+
+class AdbSyncClient:
+    # Talks the adb server's sync protocol directly over its socket, keeping
+    # a small pool of connections per device instead of forking adb for
+    # every stat and pull.
+
+    def __init__(self, adb_device=None, host="127.0.0.1", port=None, timeout=30.0):
+        self.adb_device = adb_device
+        self.host = host
+        self.port = port or int(os.environ.get("ANDROID_ADB_SERVER_PORT", "5037"))
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _read_exact(sock, size):
+        chunks = []
+        while size:
+            chunk = sock.recv(min(size, 1 << 16))
+            if not chunk:
+                raise ConnectionError("adb server closed the connection")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def _request(self, sock, service):
+        data = service.encode("utf-8")
+        sock.sendall(b"%04x" % len(data) + data)
+        if self._read_exact(sock, 4) != b"OKAY":
+            length = int(self._read_exact(sock, 4), 16)
+            raise RuntimeError(self._read_exact(sock, length).decode("utf-8", errors="replace"))
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        try:
+            self._request(sock, f"host:transport:{self.adb_device}" if self.adb_device else "host:transport-any")
+            self._request(sock, "sync:")
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    @contextmanager
+    def _connection(self):
+        with self.lock:
+            sock = self.idle.pop() if self.idle else None
+        if sock is None:
+            sock = self._connect()
+        try:
+            yield sock
+        except BaseException:
+            sock.close()
+            raise
+        with self.lock:
+            self.idle.append(sock)
+
+    def _send(self, sock, command, remote):
+        data = remote.encode("utf-8")
+        sock.sendall(command + struct.pack("<I", len(data)) + data)
+
+    def stat(self, remote):
+        with self._connection() as sock:
+            self._send(sock, b"STAT", remote)
+            ident, mode, size, mtime = struct.unpack("<4sIII", self._read_exact(sock, 16))
+        if ident != b"STAT":
+            raise RuntimeError(f"unexpected adb sync reply {ident!r}")
+        if not mode:
+            return None
+        return size, mtime
+
+    def pull(self, remote, local):
+        with self._connection() as sock:
+            self._send(sock, b"RECV", remote)
+            with open(local, "wb") as f:
+                while True:
+                    ident, length = struct.unpack("<4sI", self._read_exact(sock, 8))
+                    if ident == b"DATA":
+                        f.write(self._read_exact(sock, length))
+                    elif ident == b"DONE":
+                        break
+                    elif ident == b"FAIL":
+                        raise RuntimeError(self._read_exact(sock, length).decode("utf-8", errors="replace"))
+                    else:
+                        raise RuntimeError(f"unexpected adb sync reply {ident!r}")
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for sock in idle:
+            sock.close()
+
+
+def adb_pull(adb_path, remote, local, adb_device=None, retries=2, retry_delay=0.5, client=None):
+    cmd = adb_command(adb_path, adb_device)
     cmd.extend(["pull", remote, str(local)])
 
     last_exc = None
     for attempt in range(retries + 1):
+        if attempt:
+            ADB_PULL_RETRIES.inc()
+        start = time.perf_counter()
         try:
-            return run(cmd)
-        except RuntimeError as exc:
+            result = client.pull(remote, local) if client is not None else run(cmd)
+            ADB_PULL_SECONDS.observe(time.perf_counter() - start, result="ok")
+            return result
+        except (RuntimeError, OSError) as exc:
+            ADB_PULL_SECONDS.observe(time.perf_counter() - start, result="error")
             last_exc = exc
             if attempt >= retries:
                 break
@@ -37,9 +185,296 @@ def adb_pull(adb_path, remote, local, adb_device=None, retries=2, retry_delay=0.
         raise last_exc
 
 
+def remote_signature(adb_path, remote, adb_device=None, client=None):
+    if client is not None:
+        try:
+            stats = [client.stat(path) for path in (remote, remote + "-wal")]
+        except (RuntimeError, OSError):
+            return None
+        # Sync STAT only has one-second mtimes, so a file written within the
+        # last couple of seconds could still change without its stat changing.
+        if any(st is not None and st[1] >= time.time() - 2 for st in stats):
+            return None
+        return repr(stats)
+
+    paths = " ".join(shlex.quote(path) for path in (remote, remote + "-wal"))
+    cmd = adb_command(adb_path, adb_device)
+    cmd.extend(["shell", f"stat -c '%n %s %y' {paths} 2>/dev/null; true"])
+    try:
+        out = run(cmd).strip()
+    except RuntimeError:
+        return None
+    return out or None
+
+
+class LocalDbSlots:
+    # Double-buffered local copy of one device database.  A pull always
+    # lands in the slot nobody is reading, is made self-contained (WAL folded
+    # in) in a temp directory, and only then becomes current, so readers
+    # inside read() never see a half-written or mismatched file.
+
+    def __init__(self, path, setup_sql=None):
+        self.path = Path(path)
+        self.setup_sql = setup_sql
+        self.slots = [self.path.with_name(f"{self.path.name}.{i}") for i in range(2)]
+        self.current = None
+        self.readers = [0, 0]
+        self.cond = threading.Condition()
+
+    def current_path(self):
+        current = self.current
+        return None if current is None else self.slots[current]
+
+    @contextmanager
+    def read(self):
+        with self.cond:
+            current = self.current
+            if current is None:
+                raise RuntimeError(f"{self.path.name} has not been pulled yet")
+            self.readers[current] += 1
+        try:
+            yield self.slots[current]
+        finally:
+            with self.cond:
+                self.readers[current] -= 1
+                self.cond.notify_all()
+
+    def pull(self, fetch):
+        target = 0 if self.current is None else 1 - self.current
+        with self.cond:
+            self.cond.wait_for(lambda: self.readers[target] == 0)
+        tmp_dir = self.path.with_name(f".{self.path.name}.pull")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+        try:
+            tmp_path = tmp_dir / self.path.name
+            fetch(tmp_path)
+            # Fold any -wal into the main file so the slot is a single,
+            # self-contained database that needs no sidecars.
+            con = sqlite3.connect(tmp_path)
+            try:
+                con.execute("PRAGMA journal_mode=DELETE")
+                if self.setup_sql:
+                    try:
+                        con.executescript(self.setup_sql)
+                    except sqlite3.OperationalError:
+                        pass
+            finally:
+                con.close()
+            os.replace(tmp_path, self.slots[target])
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        with self.cond:
+            self.current = target
+        return self.slots[target]
+
+
+@contextmanager
+def reading(*sources):
+    with ExitStack() as stack:
+        yield [
+            stack.enter_context(source.read()) if isinstance(source, LocalDbSlots) else source
+            for source in sources
+        ]
+
+
+def pull_database(adb_path, remote, local, adb_device=None, client=None):
+    adb_pull(adb_path, remote, local, adb_device, client=client)
+    # The -shm index is deliberately not pulled: SQLite rebuilds it from the
+    # WAL, while a copy taken from the running app could disagree with it.
+    wal_path = Path(f"{local}-wal")
+    try:
+        adb_pull(adb_path, remote + "-wal", wal_path, adb_device, retries=0, client=client)
+    except (RuntimeError, OSError):
+        wal_path.unlink(missing_ok=True)
+
+
+def pull_if_changed(adb_path, remote, slots, adb_device=None, signatures=None, client=None, attempts=2):
+    if signatures is None:
+        signatures = {}
+    signature = remote_signature(adb_path, remote, adb_device, client)
+    if signature is not None and signatures.get(remote) == signature and slots.current is not None:
+        return False
+    for _ in range(attempts):
+        slots.pull(lambda local: pull_database(adb_path, remote, local, adb_device, client))
+        # The database and its WAL are separate transfers; if the app wrote
+        # in between, pull again rather than keep a mismatched pair.
+        after = remote_signature(adb_path, remote, adb_device, client)
+        if after == signature:
+            break
+        signature = after
+    signatures[remote] = signature
+    return True
+
+
+def pull_databases(adb_path, pulls, adb_device=None, signatures=None, client=None):
+    if signatures is None:
+        signatures = {}
+    with ThreadPoolExecutor(max_workers=len(pulls)) as pool:
+        futures = [
+            pool.submit(pull_if_changed, adb_path, remote, slots, adb_device, signatures, client)
+            for remote, slots in pulls
+        ]
+        return [future.result() for future in futures]
+
+
+def file_signature(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def encode_columns(columns):
+    # typeof/hex keeps every value on one line and free of separators, so
+    # blobs and text with newlines survive the trip through the shell.
+    return " || '|' || ".join(f"typeof({col}) || ':' || hex({col})" for col in columns)
+
+
+def decode_value(field):
+    kind, _, data = field.partition(":")
+    if kind == "null":
+        return None
+    raw = bytes.fromhex(data)
+    if kind == "integer":
+        return int(raw)
+    if kind == "real":
+        return float(raw)
+    if kind == "text":
+        return raw.decode("utf-8", errors="replace")
+    return raw
+
+
+def adb_query(adb_path, remote_db, columns, sql_tail, adb_device=None, sqlite3_path="sqlite3"):
+    sql = f"SELECT {encode_columns(columns)} {sql_tail}"
+    cmd = adb_command(adb_path, adb_device)
+    cmd.extend(["exec-out", f"{sqlite3_path} -batch -noheader {shlex.quote(remote_db)} {shlex.quote(sql)}"])
+    out = run(cmd)
+    return [tuple(decode_value(field) for field in line.split("|")) for line in out.splitlines() if line.strip()]
+
+
+MIRROR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trackz (
+    key TEXT PRIMARY KEY, etag TEXT, updateDt INTEGER, json TEXT, beginDt INTEGER, endDt INTEGER,
+    familyKey TEXT, childKey TEXT, trackGroupKey TEXT, trackTypeKey TEXT,
+    formulaName TEXT, medicineName TEXT, note TEXT
+);
+CREATE TABLE IF NOT EXISTS serverCache (path TEXT PRIMARY KEY, value BLOB);
+CREATE TABLE IF NOT EXISTS mirrorMeta (name TEXT PRIMARY KEY, value TEXT);
+""" + TRACKZ_INDEXES + TRACKZ_UPDATE_INDEX
+
+NAME_CACHE_FILTER = "FROM serverCache WHERE path LIKE '/familyz/%/childz/' OR path LIKE '/userz/%/_/'"
+
+
+# Mirrors just the rows the exporter needs by querying the device databases:
+# trackz rows past the stored updateDt/rowid watermark plus the child and
+# user name entries from the Firebase cache, each behind an aggregate
+# fingerprint so an idle device costs two tiny queries.  The mirror has the
+# same tables as the device files, so it can be read as both nara_db_path
+# and firebase_db_path.  Like LiveCollector, a key/etag sweep (and a name
+# refetch) also runs every resync_interval seconds, for edits that leave
+# the fingerprints unchanged.  Returns whether the mirror changed.
+def sync_remote_db(
+    adb_path,
+    mirror_path,
+    adb_device=None,
+    lookback_ms=10 * 60 * 1000,
+    sqlite3_path="sqlite3",
+    resync_interval=3600.0,
+):
+    def query(remote_db, columns, sql_tail):
+        return adb_query(adb_path, remote_db, columns, sql_tail, adb_device, sqlite3_path)
+
+    columns = [col.strip() for col in TRACKZ_COLUMNS.split(",")]
+    placeholders = ",".join("?" * len(columns))
+    upsert = f"INSERT OR REPLACE INTO trackz ({TRACKZ_COLUMNS}) VALUES ({placeholders})"
+    con = sqlite3.connect(mirror_path)
+    try:
+        con.executescript(MIRROR_SCHEMA)
+        meta = dict(con.execute("SELECT name, value FROM mirrorMeta"))
+        changed = False
+
+        try:
+            stats = query(REMOTE_NARA_DB, ["COUNT(*)", "MAX(rowid)", "MAX(updateDt)", "TOTAL(updateDt)"], "FROM trackz")[0]
+        except RuntimeError:
+            stats = query(REMOTE_NARA_DB, ["COUNT(*)", "NULL", "MAX(updateDt)", "TOTAL(updateDt)"], "FROM trackz")[0]
+        fingerprint = json.dumps(stats)
+        now = time.time()
+        resync_due = now - float(meta.get("lastResync") or 0) >= resync_interval
+        changed_fingerprint = fingerprint != meta.get("fingerprint")
+        if changed_fingerprint or resync_due:
+            count, max_rowid, max_update = stats[:3]
+            updated = 0
+            if changed_fingerprint:
+                tail = "FROM trackz"
+                if meta.get("watermark") is not None:
+                    tail += f" WHERE updateDt >= {int(float(meta['watermark'])) - lookback_ms}"
+                    if max_rowid is not None and meta.get("maxRowid") is not None:
+                        tail += f" OR rowid > {int(float(meta['maxRowid']))}"
+                local_etags = dict(con.execute("SELECT key, etag FROM trackz"))
+                rows = [row for row in query(REMOTE_NARA_DB, columns, tail) if local_etags.get(row[0], ()) != row[1]]
+                con.executemany(upsert, rows)
+                updated = len(rows)
+            local_count = con.execute("SELECT COUNT(*) FROM trackz").fetchone()[0]
+
+            if meta.get("watermark") is None:
+                meta["lastResync"] = now
+            elif resync_due or not updated or local_count != count:
+                # Deletions, or edits carrying an old updateDt: compare keys and
+                # etags, then fetch just the rows that differ.
+                local_etags = dict(con.execute("SELECT key, etag FROM trackz"))
+                remote_etags = dict(query(REMOTE_NARA_DB, ["key", "etag"], "FROM trackz"))
+                gone = [(key,) for key in local_etags if key not in remote_etags]
+                con.executemany("DELETE FROM trackz WHERE key = ?", gone)
+                stale = [key for key, etag in remote_etags.items() if local_etags.get(key, ()) != etag]
+                for start in range(0, len(stale), 200):
+                    hexes = ",".join(f"'{key.encode('utf-8').hex().upper()}'" for key in stale[start:start + 200])
+                    con.executemany(upsert, query(REMOTE_NARA_DB, columns, f"FROM trackz WHERE hex(key) IN ({hexes})"))
+                updated += len(stale) + len(gone)
+                meta["lastResync"] = now
+
+            changed = changed or bool(updated)
+            con.executemany(
+                "INSERT OR REPLACE INTO mirrorMeta (name, value) VALUES (?, ?)",
+                [
+                    ("fingerprint", fingerprint),
+                    ("watermark", str(max_update) if max_update is not None else meta.get("watermark")),
+                    ("maxRowid", str(max_rowid) if max_rowid is not None else None),
+                    ("lastResync", str(meta.get("lastResync") or 0)),
+                ],
+            )
+
+        names_stats = query(
+            REMOTE_FIREBASE_DB, ["COUNT(*)", "TOTAL(length(path))", "TOTAL(length(value))"], NAME_CACHE_FILTER
+        )[0]
+        names_fingerprint = json.dumps(names_stats)
+        if names_fingerprint != meta.get("namesFingerprint") or resync_due:
+            names = dict(query(REMOTE_FIREBASE_DB, ["path", "value"], NAME_CACHE_FILTER))
+            if names != dict(con.execute("SELECT path, value FROM serverCache")):
+                con.execute("DELETE FROM serverCache")
+                con.executemany("INSERT INTO serverCache (path, value) VALUES (?, ?)", names.items())
+                changed = True
+            con.execute(
+                "INSERT OR REPLACE INTO mirrorMeta (name, value) VALUES ('namesFingerprint', ?)", (names_fingerprint,)
+            )
+
+        con.commit()
+        return changed
+    finally:
+        con.close()
+
+
 def load_json_blob(value):
     if value is None:
         return None
+    if isinstance(value, (bytes, str)):
+        # Fast path: decode straight from the stored bytes.  Anything unusual
+        # (blank, invalid UTF-8, ...) falls through to the tolerant path below.
+        try:
+            return json_loads(value)
+        except ValueError:
+            pass
     if isinstance(value, bytes):
         text = value.decode("utf-8", errors="ignore")
     else:
@@ -50,127 +485,1057 @@ def load_json_blob(value):
     return json.loads(text)
 
 
-def load_child_map(firebase_db_path, family_keys):
+# The only payload fields read for every event; SQLite extracts them so the
+# rest of each payload is only decoded when something asks for it.
+PAYLOAD_FIELDS = ("createUserKey", "userKey", "routineName")
+
+
+class LazyPayload(Mapping):
+    __slots__ = ("raw", "fields", "data")
+
+    def __init__(self, raw, fields):
+        self.raw = raw
+        self.fields = fields
+        self.data = None if raw is not None else dict(fields)
+
+    def load(self):
+        # Renders run on several threads.  Whoever clears raw has already
+        # set data, so a racing load either decodes the same raw again or
+        # sees raw gone and returns that data; it never replaces it.
+        raw = self.raw
+        if raw is None:
+            return self.data
+        # A malformed payload reads as empty, like the guarded json_extract
+        # that produced its fields, rather than failing whoever renders it.
+        try:
+            data = load_json_blob(raw)
+        except ValueError:
+            data = None
+        self.data = data if isinstance(data, dict) else dict(self.fields)
+        self.raw = None
+        return self.data
+
+    def get(self, key, default=None):
+        if self.data is None and key in PAYLOAD_FIELDS:
+            return self.fields.get(key, default)
+        return self.load().get(key, default)
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def __bool__(self):
+        return True
+
+
+def has_json1(con):
+    try:
+        con.execute("SELECT json_valid('{}')")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def trackz_select(con, guarded=False):
+    if not has_json1(con):
+        return f"SELECT {TRACKZ_COLUMNS} FROM trackz"
+    doc = "CAST(json AS TEXT)"
+    if guarded:
+        doc = f"CASE WHEN json_valid({doc}) THEN {doc} END"
+    paths = ", ".join(f"'$.{field}'" for field in PAYLOAD_FIELDS)
+    return f"SELECT {TRACKZ_COLUMNS}, json_extract({doc}, {paths}) AS payloadFields FROM trackz"
+
+
+def execute_trackz(cur, tail, params=()):
+    try:
+        return cur.execute(f"{trackz_select(cur.connection)} {tail}", params)
+    except sqlite3.OperationalError:
+        # A malformed payload aborts json_extract; retry skipping those rows'
+        # fields (their full payload still decodes lazily as before).
+        return cur.execute(f"{trackz_select(cur.connection, guarded=True)} {tail}", params)
+
+
+def parse_child_names(value):
     child_map = {}
-    if not firebase_db_path.exists():
+    data = load_json_blob(value) or {}
+    for child_key, child in data.items():
+        name = child.get("name") if isinstance(child, dict) else None
+        if name:
+            child_map[child_key] = name
+    return child_map
+
+
+def parse_user_name(value):
+    data = load_json_blob(value) or {}
+    return data.get("name") if isinstance(data, dict) else None
+
+
+class NameResolver:
+    # Keeps the Firebase cache connection open while the file is the same,
+    # and only re-decodes a serverCache blob when its content hash changes.
+
+    def __init__(self):
+        self.con = None
+        self.con_key = None
+        self.parsed = {}
+
+    def _cursor(self, firebase_db_path):
+        signature = file_signature(firebase_db_path)
+        if signature is None:
+            self.close()
+            return None
+        key = (str(firebase_db_path), signature[0])
+        if key != self.con_key:
+            self.close()
+            self.con = sqlite3.connect(firebase_db_path, check_same_thread=False)
+            self.con_key = key
+        return self.con.cursor()
+
+    def _parse(self, path, value, parse):
+        raw = value if isinstance(value, bytes) else str(value).encode("utf-8")
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        cached = self.parsed.get(path)
+        if cached is not None and cached[0] == digest:
+            return cached[1]
+        result = parse(value)
+        self.parsed[path] = (digest, result)
+        return result
+
+    def child_map(self, firebase_db_path, family_keys):
+        child_map = {}
+        cur = self._cursor(firebase_db_path)
+        if cur is None or not family_keys:
+            return child_map
+        paths = [f"/familyz/{family_key}/childz/" for family_key in family_keys]
+        placeholders = ",".join("?" * len(paths))
+        cur.execute(f"SELECT path, value FROM serverCache WHERE path IN ({placeholders})", paths)
+        values = dict(cur.fetchall())
+        for path in paths:
+            if values.get(path) is not None:
+                child_map.update(self._parse(path, values[path], parse_child_names))
         return child_map
-    con = sqlite3.connect(firebase_db_path)
-    cur = con.cursor()
-    for family_key in family_keys:
-        path = f"/familyz/{family_key}/childz/"
-        cur.execute("SELECT value FROM serverCache WHERE path = ?", (path,))
-        row = cur.fetchone()
-        if not row:
-            continue
-        data = load_json_blob(row[0]) or {}
-        for child_key, child in data.items():
-            name = child.get("name") if isinstance(child, dict) else None
+
+    def user_map(self, firebase_db_path):
+        user_map = {}
+        cur = self._cursor(firebase_db_path)
+        if cur is None:
+            return user_map
+        cur.execute("SELECT path, value FROM serverCache WHERE path LIKE '/userz/%/_/'")
+        for path, value in cur.fetchall():
+            parts = path.split("/")
+            if len(parts) < 4 or value is None:
+                continue
+            name = self._parse(path, value, parse_user_name)
             if name:
-                child_map[child_key] = name
-    con.close()
-    return child_map
+                user_map[parts[2]] = name
+        return user_map
+
+    def close(self):
+        if self.con is not None:
+            self.con.close()
+        self.con = None
+        self.con_key = None
+
+
+def load_child_map(firebase_db_path, family_keys):
+    names = NameResolver()
+    try:
+        return names.child_map(firebase_db_path, family_keys)
+    finally:
+        names.close()
 
 
 def load_user_map(firebase_db_path):
-    user_map = {}
-    if not firebase_db_path.exists():
-        return user_map
-    con = sqlite3.connect(firebase_db_path)
-    cur = con.cursor()
-    cur.execute("SELECT path, value FROM serverCache WHERE path LIKE '/userz/%/_/'")
-    for path, value in cur.fetchall():
-        parts = path.split("/")
-        if len(parts) < 4:
-            continue
-        user_key = parts[2]
-        data = load_json_blob(value) or {}
-        name = data.get("name") if isinstance(data, dict) else None
-        if name:
-            user_map[user_key] = name
-    con.close()
-    return user_map
+    names = NameResolver()
+    try:
+        return names.user_map(firebase_db_path)
+    finally:
+        names.close()
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class Event:
+    # Compact in-memory form of a trackz row.  Keys shared by many rows are
+    # interned and names are resolved at export time, so a snapshot holds
+    # little more than the row itself; to_dict builds the --out JSON form.
+    __slots__ = (
+        "key",
+        "family_key",
+        "child_key",
+        "track_group_key",
+        "track_type_key",
+        "begin_dt",
+        "end_dt",
+        "note",
+        "create_user_key",
+        "payload",
+    )
 
+    def __init__(self, key, family_key, child_key, track_group_key, track_type_key, begin_dt, end_dt, note, create_user_key, payload):
+        self.key = key
+        self.family_key = intern(family_key)
+        self.child_key = intern(child_key)
+        self.track_group_key = intern(track_group_key)
+        self.track_type_key = intern(track_type_key)
+        self.begin_dt = begin_dt
+        self.end_dt = end_dt
+        self.note = note
+        self.create_user_key = intern(create_user_key)
+        self.payload = payload
+
+    def to_dict(self, child_map, user_map):
+        return {
+            "key": self.key,
+            "familyKey": self.family_key,
+            "childKey": self.child_key,
+            "childName": child_map.get(self.child_key),
+            "trackGroupKey": self.track_group_key,
+            "trackTypeKey": self.track_type_key,
+            "beginDt": self.begin_dt,
+            "endDt": self.end_dt,
+            "note": self.note,
+            "createUserKey": self.create_user_key,
+            "createUserName": user_map.get(self.create_user_key),
+            "payload": dict(self.payload),
+        }
+
+
+def make_event(row):
+    if len(row) > TRACKZ_COLUMN_COUNT:
+        values = json_loads(row["payloadFields"]) if row["payloadFields"] else ()
+        fields = {field: value for field, value in zip(PAYLOAD_FIELDS, values) if value is not None}
+        payload = LazyPayload(row["json"], fields)
+    else:
+        payload = load_json_blob(row["json"]) or {}
+    return Event(
+        row["key"],
+        row["familyKey"],
+        row["childKey"],
+        row["trackGroupKey"],
+        row["trackTypeKey"],
+        row["beginDt"],
+        row["endDt"],
+        row["note"],
+        payload.get("createUserKey") or payload.get("userKey"),
+        payload,
+    )
+
+
+DURATION_UNITS = {"s": 1000, "m": 60 * 1000, "h": 60 * 60 * 1000, "d": 24 * 60 * 60 * 1000}
+
+
+def parse_duration(value):
+    # "48h", "90m", "2d" or plain seconds, in milliseconds; empty, "0" or
+    # "all" mean no limit.
+    value = (value or "").strip().lower()
+    if value in ("", "0", "all"):
+        return None
+    unit = DURATION_UNITS.get(value[-1])
+    number = value[:-1] if unit else value
+    try:
+        number = float(number)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number):
+        raise ValueError(f"invalid duration: {value!r}")
+    ms = int(number * (unit or 1000))
+    return ms if ms > 0 else None
 
-def collect_live_data(nara_db_path, firebase_db_path, limit=None):
+
+# Rows that begin inside the window, plus the newest row of every
+# (childKey, trackGroupKey) pair however old it is, so a rarely-logged
+# child still has a latest feed and diaper.  TRACKZ_INDEXES makes the
+# per-pair lookups index seeks.
+WINDOW_FILTER = (
+    "(beginDt >= ? OR rowid IN (SELECT (SELECT rowid FROM trackz AS latest"
+    " WHERE latest.childKey IS pair.childKey AND latest.trackGroupKey IS pair.trackGroupKey"
+    " ORDER BY latest.beginDt DESC LIMIT 1)"
+    " FROM (SELECT DISTINCT childKey, trackGroupKey FROM trackz) AS pair))"
+)
+
+
+def window_filter(since_ms, now_ms=None):
+    if not since_ms:
+        return "1", ()
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    return WINDOW_FILTER, (now_ms - since_ms,)
+
+
+@contextmanager
+def open_live_data(nara_db_path, firebase_db_path, limit=None, since_ms=None):
+    # Like collect_live_data, but "events" is a generator over the open
+    # cursor so a writer can stream them without holding the whole list.
     con = sqlite3.connect(nara_db_path)
     con.row_factory = sqlite3.Row
-    cur = con.cursor()
-    cur.execute("SELECT DISTINCT familyKey FROM trackz")
-    family_keys = [r[0] for r in cur.fetchall() if r[0]]
+    try:
+        cur = con.cursor()
+        cur.execute("SELECT DISTINCT familyKey FROM trackz")
+        family_keys = [r[0] for r in cur.fetchall() if r[0]]
 
-    child_map = load_child_map(firebase_db_path, family_keys)
-    user_map = load_user_map(firebase_db_path)
+        child_map = load_child_map(firebase_db_path, family_keys)
+        user_map = load_user_map(firebase_db_path)
 
-    sql = "SELECT key, etag, updateDt, json, beginDt, endDt, familyKey, childKey, trackGroupKey, trackTypeKey, formulaName, medicineName, note FROM trackz ORDER BY beginDt DESC"
-    if limit:
-        sql += f" LIMIT {int(limit)}"
-    cur.execute(sql)
+        where, params = window_filter(since_ms)
+        tail = f"WHERE {where} ORDER BY beginDt DESC"
+        if limit:
+            tail += f" LIMIT {int(limit)}"
+        execute_trackz(cur, tail, params)
 
-    events = []
-    for row in cur.fetchall():
-        payload = load_json_blob(row["json"]) or {}
-        create_user_key = payload.get("createUserKey") or payload.get("userKey")
-        event = {
-            "key": row["key"],
-            "familyKey": row["familyKey"],
-            "childKey": row["childKey"],
-            "childName": child_map.get(row["childKey"]),
-            "trackGroupKey": row["trackGroupKey"],
-            "trackTypeKey": row["trackTypeKey"],
-            "beginDt": row["beginDt"],
-            "endDt": row["endDt"],
-            "note": row["note"],
-            "createUserKey": create_user_key,
-            "createUserName": user_map.get(create_user_key),
-            "payload": payload,
+        yield {
+            "generatedAt": int(time.time() * 1000),
+            "familyKeys": family_keys,
+            "children": child_map,
+            "users": user_map,
+            "events": (make_event(row) for row in cur),
+        }
+    finally:
+        con.close()
+
+
+def collect_live_data(nara_db_path, firebase_db_path, limit=None, since_ms=None):
+    with open_live_data(nara_db_path, firebase_db_path, limit, since_ms) as data:
+        return dict(data, events=list(data["events"]))
+
+
+OUT_FORMATS = ("pretty", "compact", "ndjson")
+
+
+def encode_live_json(data, out_format="pretty"):
+    # Yields (chunk, hashed) pairs; only the generatedAt line is unhashed,
+    # so the digest changes only when the content does.  "pretty" and
+    # "compact" match json.dumps with indent=2 and with no whitespace;
+    # "ndjson" is a header object followed by one event per line.
+    children = data["children"]
+    users = data["users"]
+    meta = {key: value for key, value in data.items() if key not in ("generatedAt", "events")}
+    generated = json.dumps(data["generatedAt"])
+    if out_format == "ndjson":
+        yield '{"generatedAt":' + generated + ",", False
+        yield json.dumps(meta, separators=(",", ":"))[1:] + "\n", True
+        for event in data["events"]:
+            yield json.dumps(event.to_dict(children, users), separators=(",", ":")) + "\n", True
+        return
+    if out_format == "compact":
+        yield '{"generatedAt":' + generated + ",", False
+        yield json.dumps(meta, separators=(",", ":"))[1:-1] + ',"events":[', True
+        sep = ""
+        for event in data["events"]:
+            yield sep + json.dumps(event.to_dict(children, users), separators=(",", ":")), True
+            sep = ","
+        yield "]}", True
+        return
+    yield '{\n  "generatedAt": ' + generated + ",\n", False
+    yield json.dumps(meta, indent=2)[2:-2] + ',\n  "events": [', True
+    sep = "\n"
+    for event in data["events"]:
+        yield sep + json.dumps(event.to_dict(children, users), indent=2).replace("\n", "\n    ").join(("    ", "")), True
+        sep = ",\n"
+    yield ("\n  ]\n}" if sep != "\n" else "]\n}"), True
+
+
+def digest_path(out_path):
+    return out_path.with_name(f".{out_path.name}.digest")
+
+
+def read_digest(out_path):
+    # The digest recorded by the run that wrote out_path, if out_path is
+    # still exactly the file it wrote.
+    try:
+        digest, signature = digest_path(out_path).read_text().split(" ", 1)
+    except (OSError, ValueError):
+        return None
+    return digest if signature == repr(file_signature(out_path)) else None
+
+
+def write_live_json(data, out_path, out_format="pretty", previous_digest=None):
+    # Streams into a temp file beside out_path and renames it into place,
+    # so readers never see a partial file.  Returns the content digest, or
+    # None when it matches previous_digest (by default the one recorded
+    # beside out_path by the last write) and out_path was left untouched.
+    out_path = Path(out_path)
+    if previous_digest is None:
+        previous_digest = read_digest(out_path)
+    tmp_path = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    digest = hashlib.blake2b(out_format.encode(), digest_size=16)
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for chunk, hashed in encode_live_json(data, out_format):
+                f.write(chunk)
+                if hashed:
+                    digest.update(chunk.encode())
+        digest = digest.hexdigest()
+        if digest == previous_digest and out_path.exists():
+            tmp_path.unlink()
+            return None
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    try:
+        digest_path(out_path).write_text(f"{digest} {file_signature(out_path)!r}")
+    except OSError:
+        pass
+    return digest
+
+
+class LiveCollector:
+    # Incremental collect_live_data: only rows at or past the updateDt
+    # watermark (minus a lookback for rows synced late from other phones)
+    # or with a rowid past the last one seen are read, and only those with
+    # a changed etag are re-parsed.  A row-count mismatch or the periodic
+    # key/etag sweep catches deletions and anything else missed.
+    # Unchanged database files, or an unchanged trackz fingerprint, skip
+    # the row queries altogether and reuse the previous result.
+    # With since_ms only window_filter rows are kept; the key/etag sweep
+    # then covers just the window, so it runs on every change and is also
+    # what drops rows that aged out.
+
+    def __init__(
+        self,
+        nara_db_path=None,
+        firebase_db_path=None,
+        lookback_ms=10 * 60 * 1000,
+        resync_interval=3600.0,
+        since_ms=None,
+    ):
+        self.nara_db_path = nara_db_path
+        self.firebase_db_path = firebase_db_path
+        self.lookback_ms = lookback_ms
+        self.resync_interval = resync_interval
+        self.since_ms = since_ms
+        self.window = ("1", ())
+        self.events = {}
+        self.etags = {}
+        self.watermark = None
+        self.max_rowid = None
+        self.fingerprint = None
+        self.nara_signature = None
+        self.firebase_signature = None
+        self.last_resync = 0.0
+        self.family_keys = []
+        self.names = NameResolver()
+        self.child_map = {}
+        self.user_map = {}
+        self.sorted_events = []
+        self.sort_keys = []
+        self.replaced = {}
+        self.data = None
+        self.changed = False
+        self.decode_seconds = 0.0
+
+    def _store(self, row):
+        start = time.perf_counter()
+        self.replaced.setdefault(row["key"], self.events.get(row["key"]))
+        self.events[row["key"]] = make_event(row)
+        self.decode_seconds += time.perf_counter() - start
+        self.etags[row["key"]] = row["etag"]
+        update_dt = row["updateDt"]
+        if update_dt is not None and (self.watermark is None or update_dt > self.watermark):
+            self.watermark = update_dt
+
+    def _read_rows(self, cur, where, params=()):
+        changed = 0
+        window, window_params = self.window
+        execute_trackz(cur, f"WHERE ({where}) AND {window}", [*params, *window_params])
+        for row in cur:
+            key = row["key"]
+            if key in self.events and self.etags.get(key) == row["etag"]:
+                continue
+            self._store(row)
+            changed += 1
+        return changed
+
+    def _reconcile(self, cur):
+        window, window_params = self.window
+        cur.execute(f"SELECT key, etag FROM trackz WHERE {window}", window_params)
+        current = {key: etag for key, etag in cur.fetchall()}
+        changed = 0
+        for key in list(self.events):
+            if key not in current:
+                self.replaced.setdefault(key, self.events[key])
+                del self.events[key]
+                del self.etags[key]
+                changed += 1
+        stale = [key for key, etag in current.items() if key not in self.events or self.etags.get(key) != etag]
+        for start in range(0, len(stale), 500):
+            chunk = stale[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            changed += self._read_rows(cur, f"key IN ({placeholders})", chunk)
+        return changed
+
+    def _resort(self):
+        # Newest first.  A few changed rows are moved within a copy of the
+        # previous order (snapshots keep the old list) rather than sorting
+        # everything again; sort_keys mirrors it as ascending -beginDt.
+        replaced, self.replaced = self.replaced, {}
+        if not self.sorted_events or len(replaced) > 1024:
+            self.sorted_events = sorted(self.events.values(), key=lambda ev: ev.begin_dt or 0, reverse=True)
+            self.sort_keys = [-(ev.begin_dt or 0) for ev in self.sorted_events]
+            return
+        events = self.sorted_events = list(self.sorted_events)
+        keys = self.sort_keys
+        for key, old in replaced.items():
+            if old is not None:
+                i = bisect_left(keys, -(old.begin_dt or 0))
+                while events[i] is not old:
+                    i += 1
+                del events[i]
+                del keys[i]
+            new = self.events.get(key)
+            if new is not None:
+                sort_key = -(new.begin_dt or 0)
+                i = bisect_right(keys, sort_key)
+                events.insert(i, new)
+                keys.insert(i, sort_key)
+
+    def _table_stats(self, cur):
+        try:
+            cur.execute("SELECT COUNT(*), MAX(rowid), MAX(updateDt), TOTAL(updateDt) FROM trackz")
+        except sqlite3.OperationalError:
+            cur.execute("SELECT COUNT(*), NULL, MAX(updateDt), TOTAL(updateDt) FROM trackz")
+        return tuple(cur.fetchone())
+
+    def collect(self, nara_db_path=None, firebase_db_path=None):
+        nara_db_path = nara_db_path or self.nara_db_path
+        firebase_db_path = firebase_db_path or self.firebase_db_path
+        now = time.time()
+        nara_signature = file_signature(nara_db_path)
+        firebase_signature = file_signature(firebase_db_path)
+        resync_due = now - self.last_resync >= self.resync_interval
+        if (
+            self.data is not None
+            and not resync_due
+            and nara_signature == self.nara_signature
+            and firebase_signature == self.firebase_signature
+        ):
+            self.changed = False
+            return dict(self.data, generatedAt=int(now * 1000))
+
+        start = time.perf_counter()
+        names_seconds = 0.0
+        self.decode_seconds = 0.0
+        con = sqlite3.connect(nara_db_path)
+        con.row_factory = sqlite3.Row
+        cur = con.cursor()
+        changed = 0
+        renamed = False
+        self.window = window_filter(self.since_ms, int(now * 1000))
+        try:
+            stats = self._table_stats(cur)
+            count, max_rowid = stats[:2]
+            swept = False
+            if self.watermark is None:
+                changed = self._read_rows(cur, "1")
+                self.last_resync = now
+                swept = True
+            elif stats != self.fingerprint or resync_due:
+                where = "updateDt >= ?"
+                params = [self.watermark - self.lookback_ms]
+                if max_rowid is not None and self.max_rowid is not None:
+                    where += " OR rowid > ?"
+                    params.append(self.max_rowid)
+                changed = self._read_rows(cur, where, params)
+                # A changed fingerprint with nothing past the watermark means
+                # an edit carried an old updateDt, so sweep etags to find it.
+                if self.since_ms or count != len(self.events) or resync_due or not changed:
+                    changed += self._reconcile(cur)
+                    self.last_resync = now
+                    swept = True
+
+            # Between sweeps a new family can only arrive in a changed row,
+            # which saves scanning the whole table for them.
+            if swept:
+                cur.execute("SELECT DISTINCT familyKey FROM trackz")
+                family_keys = [r[0] for r in cur.fetchall() if r[0]]
+            else:
+                family_keys = list(self.family_keys)
+                for key in self.replaced:
+                    ev = self.events.get(key)
+                    if ev is not None and ev.family_key and ev.family_key not in family_keys:
+                        family_keys.append(ev.family_key)
+
+            if family_keys != self.family_keys or firebase_signature != self.firebase_signature:
+                names_start = time.perf_counter()
+                child_map = self.names.child_map(firebase_db_path, family_keys)
+                user_map = self.names.user_map(firebase_db_path)
+                names_seconds = time.perf_counter() - names_start
+                renamed = child_map != self.child_map or user_map != self.user_map
+                self.child_map = child_map
+                self.user_map = user_map
+            self.max_rowid = max_rowid
+            self.fingerprint = stats
+        finally:
+            con.close()
+        self.nara_signature = nara_signature
+        self.firebase_signature = firebase_signature
+        elapsed = time.perf_counter() - start
+        COLLECT_SECONDS.observe(self.decode_seconds, phase="decode")
+        COLLECT_SECONDS.observe(names_seconds, phase="names")
+        COLLECT_SECONDS.observe(max(0.0, elapsed - names_seconds - self.decode_seconds), phase="query")
+
+        if changed:
+            with COLLECT_SECONDS.time(phase="sort"):
+                self._resort()
+
+        self.changed = bool(changed or renamed or family_keys != self.family_keys or self.data is None)
+        self.family_keys = family_keys
+        if not self.changed:
+            return dict(self.data, generatedAt=int(now * 1000))
+        self.data = {
+            "generatedAt": int(now * 1000),
+            "familyKeys": family_keys,
+            "children": self.child_map,
+            "users": self.user_map,
+            "events": self.sorted_events,
         }
-        events.append(event)
+        return self.data
+
 
-    con.close()
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    device TEXT NOT NULL,
+    key TEXT NOT NULL,
+    etag TEXT,
+    updateDt INTEGER,
+    json TEXT,
+    beginDt INTEGER,
+    endDt INTEGER,
+    familyKey TEXT,
+    childKey TEXT,
+    trackGroupKey TEXT,
+    trackTypeKey TEXT,
+    formulaName TEXT,
+    medicineName TEXT,
+    note TEXT,
+    PRIMARY KEY (device, key)
+);
+CREATE INDEX IF NOT EXISTS events_child_group_begin ON events (childKey, trackGroupKey, beginDt, key);
+CREATE INDEX IF NOT EXISTS events_child_begin ON events (childKey, beginDt, key);
+CREATE INDEX IF NOT EXISTS events_group_begin ON events (trackGroupKey, beginDt, key);
+CREATE INDEX IF NOT EXISTS events_begin ON events (beginDt, key);
+CREATE INDEX IF NOT EXISTS events_key ON events (key, device);
+CREATE TABLE IF NOT EXISTS devices (
+    device TEXT PRIMARY KEY,
+    fingerprint TEXT,
+    watermark INTEGER,
+    maxRowid INTEGER
+);
+CREATE TABLE IF NOT EXISTS daily (
+    childKey TEXT NOT NULL,
+    day TEXT NOT NULL,
+    feeds INTEGER,
+    bottleMl REAL,
+    breastMinutes REAL,
+    diapers INTEGER,
+    wet INTEGER,
+    dirty INTEGER,
+    dry INTEGER,
+    feedIntervalMinutes REAL,
+    PRIMARY KEY (childKey, day)
+);
+CREATE TABLE IF NOT EXISTS staleDays (
+    childKey TEXT NOT NULL,
+    day TEXT NOT NULL,
+    PRIMARY KEY (childKey, day)
+);
+"""
 
-    return {
-        "generatedAt": int(time.time() * 1000),
-        "familyKeys": family_keys,
-        "children": child_map,
-        "users": user_map,
-        "events": events,
-    }
+# Every write to events marks the local day it lands on, plus the day of the
+# child's next feed, whose interval back to the previous feed it changes.
+# With recursive_triggers on, INSERT OR REPLACE fires the delete trigger for
+# the row it replaces, so an edit that moves an event marks both days.
+HISTORY_TRIGGERS = """
+CREATE TRIGGER IF NOT EXISTS events_{name}_stale AFTER {action} ON events
+WHEN {row}.childKey IS NOT NULL AND {row}.beginDt IS NOT NULL
+BEGIN
+    INSERT OR IGNORE INTO staleDays (childKey, day)
+    VALUES ({row}.childKey, date({row}.beginDt / 1000, 'unixepoch', 'localtime'));
+    INSERT OR IGNORE INTO staleDays (childKey, day)
+    SELECT {row}.childKey, date(beginDt / 1000, 'unixepoch', 'localtime') FROM events
+    WHERE {row}.trackGroupKey = 'FEED' AND childKey = {row}.childKey AND trackGroupKey = 'FEED' AND beginDt > {row}.beginDt
+    ORDER BY beginDt LIMIT 1;
+END;
+"""
 
+# Devices can share a family, so the same trackz row may be stored once per
+# device; queries keep only the copy from the first device by name.
+FIRST_COPY = "NOT EXISTS (SELECT 1 FROM events AS dup WHERE dup.key = {e}.key AND dup.device < {e}.device)"
 
-def export_live(nara_db_path, firebase_db_path, out_path, limit=None):
-    out = collect_live_data(nara_db_path, firebase_db_path, limit)
-    out_path.write_text(json.dumps(out, indent=2))
+# Gaps longer than this (a stretch nobody logged) don't count towards the
+# mean interval between feeds.
+FEED_GAP_LIMIT_MS = 24 * 60 * 60 * 1000
+
+# Rebuilds the daily rows of every stale (child, day) in one set-based pass.
+# Volumes follow bottle_volume: the formula and breast milk parts, each
+# Num * 10^-Exp, with ounces converted so different days add up.
+DAILY_REFRESH = f"""
+WITH stale AS (
+    SELECT childKey, day,
+        CAST(strftime('%s', day, 'utc') AS INTEGER) * 1000 AS dayStart,
+        CAST(strftime('%s', day, '+1 day', 'utc') AS INTEGER) * 1000 AS dayEnd
+    FROM staleDays
+),
+rows AS (
+    SELECT stale.childKey, stale.day, e.trackGroupKey AS grp, e.trackTypeKey AS type,
+        CASE WHEN json_valid(CAST(e.json AS TEXT)) THEN CAST(e.json AS TEXT) END AS doc,
+        CASE WHEN e.trackGroupKey = 'FEED' THEN e.beginDt - (
+            SELECT MAX(prev.beginDt) FROM events AS prev
+            WHERE prev.childKey = e.childKey AND prev.trackGroupKey = 'FEED' AND prev.beginDt < e.beginDt
+        ) END AS gap
+    FROM stale JOIN events AS e
+        ON e.childKey = stale.childKey AND e.beginDt >= stale.dayStart AND e.beginDt < stale.dayEnd
+    WHERE {FIRST_COPY.format(e="e")}
+),
+volumes AS (
+    SELECT *,
+        CASE WHEN type = 'FEED.BOTTLE' THEN
+            (COALESCE(json_extract(doc, '$.bottleFormulaVolumeNum')
+                * CAST('1e' || CAST(-json_extract(doc, '$.bottleFormulaVolumeExp') AS INTEGER) AS REAL), 0)
+            + COALESCE(json_extract(doc, '$.bottleBreastMilkVolumeNum')
+                * CAST('1e' || CAST(-json_extract(doc, '$.bottleBreastMilkVolumeExp') AS INTEGER) AS REAL), 0))
+            * CASE WHEN lower(COALESCE(json_extract(doc, '$.bottleVolumeUnit'), json_extract(doc, '$.bottleFormulaVolumeUnit'),
+                json_extract(doc, '$.bottleBreastMilkVolumeUnit'))) LIKE 'oz%' THEN 29.5735 ELSE 1 END
+        END AS bottle
+    FROM rows
+)
+INSERT INTO daily (childKey, day, feeds, bottleMl, breastMinutes, diapers, wet, dirty, dry, feedIntervalMinutes)
+SELECT childKey, day,
+    SUM(grp = 'FEED'),
+    TOTAL(bottle),
+    TOTAL(CASE WHEN type = 'FEED.BREAST' THEN
+        COALESCE(json_extract(doc, '$.breastLeftDuration'), 0) + COALESCE(json_extract(doc, '$.breastRightDuration'), 0)
+    END) / 60000.0,
+    SUM(grp = 'DIAPER'),
+    SUM(grp = 'DIAPER' AND json_extract(doc, '$.diaperTypePee')),
+    SUM(grp = 'DIAPER' AND json_extract(doc, '$.diaperTypePoop')),
+    SUM(grp = 'DIAPER' AND json_extract(doc, '$.diaperTypeDry')),
+    AVG(CASE WHEN gap <= {FEED_GAP_LIMIT_MS} THEN gap END) / 60000.0
+FROM volumes
+GROUP BY childKey, day
+"""
+
+DAILY_VERSION = 2
+
+DAILY_COLUMNS = ("childKey", "day", "feeds", "bottleMl", "breastMinutes", "diapers", "wet", "dirty", "dry", "feedIntervalMinutes")
+
+
+class HistoryStore:
+    # Every trackz row ever pulled, per device, kept in a local database so
+    # time-range queries never need a pull and aren't limited by --since.
+    # sync() follows LiveCollector: an unchanged fingerprint is skipped,
+    # rows past the updateDt/rowid watermark are upserted if their etag
+    # changed, and a full key/etag comparison (which also applies
+    # deletions) runs when counts disagree or nothing new was found.
+    # Per-child daily aggregates are cached in the daily table, and a sync
+    # only recomputes the days its writes touched (see HISTORY_TRIGGERS).
+
+    def __init__(self, path, lookback_ms=10 * 60 * 1000):
+        self.path = Path(path)
+        self.lookback_ms = lookback_ms
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA recursive_triggers=ON")
+        self.con.executescript(HISTORY_SCHEMA)
+        self.aggregates = has_json1(self.con)
+        if self.aggregates:
+            for action, row in (("INSERT", "NEW"), ("DELETE", "OLD")):
+                self.con.executescript(HISTORY_TRIGGERS.format(name=action.lower(), action=action, row=row))
+            # Daily rows from an older DAILY_REFRESH (or none at all) are
+            # rebuilt from scratch once.
+            if self.con.execute("PRAGMA user_version").fetchone()[0] != DAILY_VERSION:
+                with self.lock:
+                    self.con.execute("BEGIN IMMEDIATE")
+                    self.con.execute("DELETE FROM daily")
+                    self.con.execute(
+                        "INSERT OR IGNORE INTO staleDays (childKey, day)"
+                        " SELECT DISTINCT childKey, date(beginDt / 1000, 'unixepoch', 'localtime') FROM events"
+                        " WHERE childKey IS NOT NULL AND beginDt IS NOT NULL"
+                    )
+                    self._refresh_daily()
+                    self.con.execute(f"PRAGMA user_version = {DAILY_VERSION}")
+                    self.con.execute("COMMIT")
+
+    def _refresh_daily(self):
+        con = self.con
+        con.execute("DELETE FROM daily WHERE (childKey, day) IN (SELECT childKey, day FROM staleDays)")
+        con.execute(DAILY_REFRESH)
+        con.execute("DELETE FROM staleDays")
+
+    def _upsert(self, device, where="1", params=()):
+        cur = self.con.execute(
+            f"INSERT OR REPLACE INTO events (device, {TRACKZ_COLUMNS})"
+            f" SELECT ?, {TRACKZ_COLUMNS} FROM src.trackz AS t WHERE ({where})"
+            " AND NOT EXISTS (SELECT 1 FROM events AS e WHERE e.device = ? AND e.key = t.key AND e.etag IS t.etag)",
+            (device, *params, device),
+        )
+        return cur.rowcount
+
+    def sync(self, nara_db_path, device="default"):
+        # Returns the number of rows written or deleted.
+        with self.lock:
+            con = self.con
+            con.execute("ATTACH DATABASE ? AS src", (str(nara_db_path),))
+            try:
+                try:
+                    stats = con.execute(
+                        "SELECT COUNT(*), MAX(rowid), MAX(updateDt), TOTAL(updateDt) FROM src.trackz"
+                    ).fetchone()
+                except sqlite3.OperationalError:
+                    stats = con.execute(
+                        "SELECT COUNT(*), NULL, MAX(updateDt), TOTAL(updateDt) FROM src.trackz"
+                    ).fetchone()
+                fingerprint = json.dumps(stats)
+                known = con.execute(
+                    "SELECT fingerprint, watermark, maxRowid FROM devices WHERE device = ?", (device,)
+                ).fetchone()
+                if known and known[0] == fingerprint:
+                    return 0
+                count, max_rowid, watermark = stats[:3]
+                con.execute("BEGIN IMMEDIATE")
+                try:
+                    changed = 0
+                    if known and known[1] is not None:
+                        where = "t.updateDt >= ?"
+                        params = [known[1] - self.lookback_ms]
+                        if max_rowid is not None and known[2] is not None:
+                            where += " OR t.rowid > ?"
+                            params.append(known[2])
+                        changed = self._upsert(device, where, params)
+                    stored = con.execute("SELECT COUNT(*) FROM events WHERE device = ?", (device,)).fetchone()[0]
+                    if not known or not changed or stored != count:
+                        changed += self._upsert(device)
+                        changed += con.execute(
+                            "DELETE FROM events WHERE device = ? AND key NOT IN (SELECT key FROM src.trackz)",
+                            (device,),
+                        ).rowcount
+                    if changed and self.aggregates:
+                        self._refresh_daily()
+                    con.execute(
+                        "INSERT OR REPLACE INTO devices (device, fingerprint, watermark, maxRowid) VALUES (?, ?, ?, ?)",
+                        (device, fingerprint, watermark, max_rowid),
+                    )
+                    con.execute("COMMIT")
+                except BaseException:
+                    con.execute("ROLLBACK")
+                    raise
+                return changed
+            finally:
+                con.execute("DETACH DATABASE src")
+
+    def query(self, child=None, group=None, start=None, end=None, before=None, limit=100):
+        # Newest first; before is the (beginDt, key) of the last event of
+        # the previous page.  Each filter combination has a matching index,
+        # so a page costs an index seek plus limit rows.
+        where, params = [FIRST_COPY.format(e="events")], []
+        if child:
+            where.append("childKey = ?")
+            params.append(child)
+        if group:
+            where.append("trackGroupKey = ?")
+            params.append(group)
+        if start is not None:
+            where.append("beginDt >= ?")
+            params.append(start)
+        if end is not None:
+            where.append("beginDt < ?")
+            params.append(end)
+        if before is not None:
+            where.append("(beginDt, key) < (?, ?)")
+            params.extend(before)
+        sql = f"SELECT {TRACKZ_COLUMNS} FROM events WHERE " + " AND ".join(where)
+        sql += " ORDER BY beginDt DESC, key DESC LIMIT ?"
+        params.append(int(limit))
+        with self._reader() as con:
+            return [make_event(row) for row in con.execute(sql, params)]
+
+    def daily(self, child=None, start=None, end=None):
+        # Cached per-day aggregates for the local days from start to end
+        # (epoch milliseconds, both inclusive), oldest first.
+        where, params = [], []
+        if child:
+            where.append("childKey = ?")
+            params.append(child)
+        if start is not None:
+            where.append("day >= date(? / 1000, 'unixepoch', 'localtime')")
+            params.append(start)
+        if end is not None:
+            where.append("day <= date(? / 1000, 'unixepoch', 'localtime')")
+            params.append(end)
+        sql = f"SELECT {', '.join(DAILY_COLUMNS)} FROM daily"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY childKey, day"
+        with self._reader() as con:
+            return [dict(row) for row in con.execute(sql, params)]
+
+    @contextmanager
+    def _reader(self):
+        # A separate connection, so WAL lets reads run alongside sync().
+        con = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+        con.row_factory = sqlite3.Row
+        try:
+            yield con
+        finally:
+            con.close()
+
+
+class RefreshSchedule:
+    # Adaptive polling: right after a change, check again at min_interval
+    # and double the delay with every unchanged refresh, up to max_interval.
+    # While someone is actively reading, the delay never exceeds interval.
+
+    def __init__(self, interval, min_interval=None, max_interval=None):
+        self.interval = interval
+        self.min_interval = min(interval, min_interval) if min_interval else interval
+        self.max_interval = max(interval, max_interval or interval)
+        self.idle = 0
+
+    def record(self, changed):
+        self.idle = 0 if changed else min(self.idle + 1, 32)
+
+    def next_delay(self, active=False):
+        delay = min(self.min_interval * 2 ** self.idle, self.max_interval)
+        return min(delay, self.interval) if active else delay
+
+
+def export_live(
+    nara_db_path,
+    firebase_db_path,
+    out_path,
+    limit=None,
+    collector=None,
+    out_format="pretty",
+    digests=None,
+    since_ms=None,
+):
+    digests = {} if digests is None else digests
+    if collector is not None:
+        out = collector.collect(nara_db_path, firebase_db_path)
+        if not collector.changed and out_path.exists():
+            return False
+        if limit:
+            out = dict(out, events=islice(out["events"], limit))
+        digest = write_live_json(out, out_path, out_format, digests.get(out_path))
+    else:
+        with open_live_data(nara_db_path, firebase_db_path, limit, since_ms) as out:
+            digest = write_live_json(out, out_path, out_format, digests.get(out_path))
+    if digest is None:
+        return False
+    digests[out_path] = digest
+    return True
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--adb-path", dest="adb_path", default=os.environ.get("ADB_PATH", "adb"))
     parser.add_argument("--out", dest="out_path", default="nara_live.json")
+    parser.add_argument(
+        "--format",
+        dest="out_format",
+        choices=OUT_FORMATS,
+        default=os.environ.get("NARA_OUT_FORMAT", "pretty"),
+        help="indented JSON, compact JSON, or NDJSON (a header line, then one event per line)",
+    )
     parser.add_argument(
         "--adb-device",
         dest="adb_device",
         default=os.environ.get("ADB_DEVICE") or os.environ.get("ANDROID_SERIAL"),
     )
+    parser.add_argument(
+        "--source",
+        dest="source",
+        choices=("pull", "query"),
+        default=os.environ.get("NARA_SOURCE", "pull"),
+        help="pull whole database files, or query changed rows on the device with sqlite3",
+    )
+    parser.add_argument(
+        "--adb-socket",
+        dest="adb_socket",
+        action="store_true",
+        default=bool(os.environ.get("NARA_ADB_SOCKET")),
+        help="pull over persistent adb server connections instead of running adb for each pull",
+    )
     parser.add_argument("--limit", dest="limit", type=int, default=None)
+    parser.add_argument(
+        "--since",
+        dest="since",
+        type=parse_duration,
+        default=os.environ.get("NARA_SINCE", ""),
+        help="only export events that began within this window (e.g. 48h), plus the latest per child and group",
+    )
+    parser.add_argument(
+        "--history",
+        dest="history",
+        default=os.environ.get("NARA_HISTORY", ""),
+        help="also keep every pulled event in this SQLite database (relative to nara_device_db)",
+    )
     parser.add_argument("--watch", dest="watch", action="store_true")
-    parser.add_argument("--interval", dest="interval", type=int, default=60)
+    parser.add_argument("--interval", dest="interval", type=float, default=60)
+    parser.add_argument(
+        "--min-interval",
+        dest="min_interval",
+        type=float,
+        default=5,
+        help="with --watch, how soon to check again right after a change",
+    )
+    parser.add_argument(
+        "--max-interval",
+        dest="max_interval",
+        type=float,
+        default=None,
+        help="with --watch, the longest wait once nothing has changed for a while (default 10x --interval)",
+    )
     args = parser.parse_args()
 
     base_dir = Path(__file__).resolve().parent.relative_to(os.getcwd())
     db_dir = base_dir / "nara_device_db"
     db_dir.mkdir(exist_ok=True)
 
-    nara_db_path = db_dir / "nara.db"
-    firebase_db_path = db_dir / "amazing-ripple-221320.firebaseio.com_default"
+    if args.source == "query":
+        nara_db = firebase_db = db_dir / "nara_mirror.db"
+    else:
+        nara_db = LocalDbSlots(db_dir / "nara.db", TRACKZ_INDEXES)
+        firebase_db = LocalDbSlots(db_dir / "amazing-ripple-221320.firebaseio.com_default")
     out_path = base_dir / args.out_path
+    collector = LiveCollector(since_ms=args.since) if args.watch else None
+    schedule = RefreshSchedule(args.interval, args.min_interval, args.max_interval or args.interval * 10)
+    client = AdbSyncClient(args.adb_device) if args.adb_socket else None
+    history = HistoryStore(db_dir / args.history) if args.history else None
+    signatures = {}
+    digests = {}
+    pulls = [(REMOTE_NARA_DB, nara_db), (REMOTE_FIREBASE_DB, firebase_db)]
 
     while True:
-        adb_pull(args.adb_path, REMOTE_NARA_DB, nara_db_path, args.adb_device)
-        adb_pull(args.adb_path, REMOTE_FIREBASE_DB, firebase_db_path, args.adb_device)
-        export_live(nara_db_path, firebase_db_path, out_path, args.limit)
+        if args.source == "query":
+            sync_remote_db(args.adb_path, nara_db, args.adb_device)
+        else:
+            pull_databases(args.adb_path, pulls, args.adb_device, signatures, client)
+        with reading(nara_db, firebase_db) as (nara_db_path, firebase_db_path):
+            export_live(
+                nara_db_path,
+                firebase_db_path,
+                out_path,
+                args.limit,
+                collector,
+                args.out_format,
+                digests,
+                args.since,
+            )
+            if history is not None:
+                history.sync(nara_db_path, args.adb_device or "default")
         if not args.watch:
             break
-        time.sleep(args.interval)
+        schedule.record(collector.changed)
+        time.sleep(schedule.next_delay())
 
 
 if __name__ == "__main__":
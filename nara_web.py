@@ -1,22 +1,59 @@
 # usage: python nara_web.py --host 0.0.0.0 --port 8888 --adb-device emulator-5554
 
 import argparse
+import gzip
+import hashlib
 import html
 import json
 import logging
 import os
+import re
+import threading
 import time
-from typing import Any, Dict, Optional, cast
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple, cast
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from nara_live_export import (
     REMOTE_FIREBASE_DB,
     REMOTE_NARA_DB,
-    adb_pull,
-    collect_live_data,
+    TRACKZ_INDEXES,
+    AdbSyncClient,
+    HistoryStore,
+    LiveCollector,
+    LocalDbSlots,
+    RefreshSchedule,
+    file_signature,
+    parse_duration,
+    pull_databases,
+    reading,
+    sync_remote_db,
 )
+from nara_metrics import Counter, Gauge, Histogram, render_metrics
+
+REFRESH_SECONDS = Histogram("nara_refresh_seconds", "Refresh time by phase (pull or sync, then collect).")
+INDEX_SECONDS = Histogram("nara_index_seconds", "Per-child index build time by step.")
+RENDER_SECONDS = Histogram("nara_render_seconds", "Time to render and serialize a response body.")
+RENDER_CACHE = Counter("nara_render_cache_total", "Rendered response cache lookups.")
+SNAPSHOT_CACHE = Counter("nara_snapshot_cache_total", "Requests served from the cached snapshot (hit) or after a refresh (miss).")
+SNAPSHOT_AGE = Gauge("nara_snapshot_age_seconds", "Age of the current snapshot.")
+EVENTS_IN_MEMORY = Gauge("nara_events_in_memory", "Events held by the collector.")
+EVENT_STREAMS = Gauge("nara_event_streams", "Open /events connections.")
+REFRESH_DELAY = Gauge("nara_refresh_delay_seconds", "Current wait before each device's next background refresh.")
+
+# Clients that polled this recently keep refreshes at the base interval.
+DEMAND_WINDOW = 120.0
+
+HISTORY_PAGE_SIZE = 100
+HISTORY_MAX_PAGE_SIZE = 1000
 
 
 def format_relative(ms, now_ms=None):
@@ -80,11 +117,11 @@ def time_colors(ms, now_ms=None):
 def latest_by_group(events, group_key):
     latest = {}
     for ev in events:
-        if ev.get("trackGroupKey") != group_key:
+        if ev.track_group_key != group_key:
             continue
-        child_key = ev.get("childKey") or "unknown"
+        child_key = ev.child_key or "unknown"
         current = latest.get(child_key)
-        if not current or ev.get("beginDt", 0) > current.get("beginDt", 0):
+        if not current or (ev.begin_dt or 0) > (current.begin_dt or 0):
             latest[child_key] = ev
     return latest
 
@@ -100,31 +137,48 @@ def local_midnight_ms(now_ms=None):
     return int(midnight_sec * 1000)
 
 
-def vitamins_today(events, now_ms=None):
-    if now_ms is None:
-        now_ms = int(time.time() * 1000)
-    midnight_ms = local_midnight_ms(now_ms)
-    result = {}
+def is_vitamin_routine(ev):
+    if ev.track_group_key != "ROUTINE":
+        return False
+    name = ev.payload.get("routineName") or ""
+    return "vitamin" in str(name).lower()
+
+
+def latest_vitamins(events):
+    latest = {}
     for ev in events:
-        if ev.get("trackGroupKey") != "ROUTINE":
-            continue
-        payload = ev.get("payload") or {}
-        name = payload.get("routineName") or ""
-        if "vitamin" not in str(name).lower():
-            continue
-        begin = ev.get("beginDt")
-        if begin is None or int(begin) < midnight_ms:
+        if not is_vitamin_routine(ev):
             continue
-        child_key = ev.get("childKey")
-        if not child_key:
+        begin = ev.begin_dt
+        child_key = ev.child_key
+        if begin is None or not child_key:
             continue
-        result[child_key] = True
-    return result
+        if int(begin) > latest.get(child_key, -1):
+            latest[child_key] = int(begin)
+    return latest
+
+
+def vitamins_since(latest, now_ms=None):
+    midnight_ms = local_midnight_ms(now_ms)
+    return {child_key: True for child_key, begin in latest.items() if begin >= midnight_ms}
+
+
+def vitamins_today(events, now_ms=None):
+    return vitamins_since(latest_vitamins(events), now_ms)
+
+
+def build_index(events):
+    with INDEX_SECONDS.time(step="latest_by_group"):
+        latest_feed = latest_by_group(events, "FEED")
+        latest_diaper = latest_by_group(events, "DIAPER")
+    with INDEX_SECONDS.time(step="latest_vitamins"):
+        vitamins = latest_vitamins(events)
+    return {"FEED": latest_feed, "DIAPER": latest_diaper, "vitamins": vitamins}
 
 
 def feed_label(ev):
-    t = ev.get("trackTypeKey") or "FEED"
-    payload = ev.get("payload") or {}
+    t = ev.track_type_key or "FEED"
+    payload = ev.payload
     if t == "FEED.BOTTLE":
         vol, unit = bottle_volume(payload)
         if vol is not None and unit:
@@ -197,7 +251,7 @@ def bottle_volume(payload):
 def diaper_label(ev):
     if not ev:
         return "unknown"
-    payload = ev.get("payload") or {}
+    payload = ev.payload
     parts = []
     if payload.get("diaperTypePee"):
         parts.append("Wet")
@@ -218,7 +272,7 @@ def diaper_label(ev):
     return "/".join(parts) if parts else "Diaper"
 
 
-def build_body(latest_feed, latest_diaper, child_map, generated_at, vitamins=None):
+def build_body(latest_feed, latest_diaper, child_map, generated_at, vitamins=None, is_stale=False):
     now_ms = int(time.time() * 1000)
     if vitamins is None:
         vitamins = {}
@@ -237,23 +291,27 @@ def build_body(latest_feed, latest_diaper, child_map, generated_at, vitamins=Non
             name_html += " &#128138;"
         feed_ev = latest_feed.get(child_key)
         diaper_ev = latest_diaper.get(child_key)
-        feed_when = format_relative(feed_ev.get("beginDt"), now_ms) if feed_ev else "unknown"
+        feed_when = format_relative(feed_ev.begin_dt, now_ms) if feed_ev else "unknown"
         feed_text = feed_label(feed_ev) if feed_ev else "unknown"
-        diaper_when = format_relative(diaper_ev.get("beginDt"), now_ms) if diaper_ev else "unknown"
+        diaper_when = format_relative(diaper_ev.begin_dt, now_ms) if diaper_ev else "unknown"
         diaper_text = diaper_label(diaper_ev)
-        feed_bg, feed_fg = time_colors(feed_ev.get("beginDt") if feed_ev else None, now_ms)
-        diaper_bg, diaper_fg = time_colors(diaper_ev.get("beginDt") if diaper_ev else None, now_ms)
+        feed_begin = feed_ev.begin_dt if feed_ev else None
+        diaper_begin = diaper_ev.begin_dt if diaper_ev else None
+        feed_bg, feed_fg = time_colors(feed_begin, now_ms)
+        diaper_bg, diaper_fg = time_colors(diaper_begin, now_ms)
         rows.append(
-            "<tr>"
-            f"<td class=\"group\">{name_html}</td>"
-            f"<td class=\"group\">{html.escape(feed_text)}</td>"
-            f"<td class=\"time\" style=\"background:{feed_bg}; color:{feed_fg};\">{html.escape(feed_when)}</td>"
-            f"<td class=\"group\">{html.escape(diaper_text)}</td>"
-            f"<td class=\"time\" style=\"background:{diaper_bg}; color:{diaper_fg};\">{html.escape(diaper_when)}</td>"
+            f"<tr data-child=\"{html.escape(child_key)}\">"
+            f"<td class=\"group\" data-field=\"name\">{name_html}</td>"
+            f"<td class=\"group\" data-field=\"feed-label\">{html.escape(feed_text)}</td>"
+            f"<td class=\"time\" data-field=\"feed-time\" data-begin=\"{feed_begin or ''}\" style=\"background:{feed_bg}; color:{feed_fg};\">{html.escape(feed_when)}</td>"
+            f"<td class=\"group\" data-field=\"diaper-label\">{html.escape(diaper_text)}</td>"
+            f"<td class=\"time\" data-field=\"diaper-time\" data-begin=\"{diaper_begin or ''}\" style=\"background:{diaper_bg}; color:{diaper_fg};\">{html.escape(diaper_when)}</td>"
             "</tr>"
         )
 
     generated = time.strftime("%Y-%m-%d %H:%M", time.localtime(generated_at / 1000))
+    if is_stale:
+        generated += " (stale)"
     rows_html = "\n".join(rows) or "<tr><td colspan=\"5\">No feeds found</td></tr>"
     return f"""
     <table>
@@ -282,142 +340,286 @@ def build_body(latest_feed, latest_diaper, child_map, generated_at, vitamins=Non
     """.strip()
 
 
-def build_html(latest_feed, latest_diaper, child_map, generated_at, body_class="", vitamins=None):
-    body_html = build_body(latest_feed, latest_diaper, child_map, generated_at, vitamins)
-    css = """
-    @import url("https://fonts.googleapis.com/css2?family=Mystery+Quest&family=Slackey&display=swap");
-    @view-transition { navigation: auto; }
-    * { box-sizing: border-box; }
-    body {
-      margin: 0;
-      min-height: 100vh;
-      background: #0b0b0b;
-      color: #f2f2f2;
-      display: flex;
-      justify-content: center;
-      align-items: center;
-    }
-    body.bottom {
-      align-items: flex-end;
-    }
-    .container {
-      width: min(98vw, 1600px);
-      padding: clamp(8px, 1.6vw, 24px);
-      font-family: "Mystery Quest", "Noto Sans", cursive;
-    }
-    .meta {
-      color: #a3a3a3;
-      font-size: clamp(12px, 1vw + 6px, 16px);
-      white-space: nowrap;
-    }
-    .actions {
-      display: flex;
-      justify-content: space-between;
-      align-items: center;
-      margin-top: clamp(8px, 1.2vw, 16px);
-    }
-    .btn {
-      appearance: none;
-      border: 1px solid #2a2a2a;
-      background: #141414;
-      color: #f2f2f2;
-      padding: 8px 12px;
-      font-size: clamp(12px, 1vw + 6px, 16px);
-      border-radius: 6px;
-      cursor: pointer;
-    }
-    .btn:hover { background: #1b1b1b; }
-    table {
-      border-collapse: collapse;
-      width: 100%;
-      font-size: clamp(12px, 1.4vw + 8px, 30px);
-      table-layout: fixed;
-    }
-    th, td {
-      text-align: left;
-      padding: clamp(8px, 1.2vw, 16px) clamp(10px, 1.6vw, 22px);
-      border-bottom: 1px solid #2a2a2a;
-      line-height: 1.2;
+PAGE_CSS = """
+@import url("https://fonts.googleapis.com/css2?family=Mystery+Quest&family=Slackey&display=swap");
+@view-transition { navigation: auto; }
+* { box-sizing: border-box; }
+body {
+  margin: 0;
+  min-height: 100vh;
+  background: #0b0b0b;
+  color: #f2f2f2;
+  display: flex;
+  justify-content: center;
+  align-items: center;
+}
+body.bottom {
+  align-items: flex-end;
+}
+.container {
+  width: min(98vw, 1600px);
+  padding: clamp(8px, 1.6vw, 24px);
+  font-family: "Mystery Quest", "Noto Sans", cursive;
+}
+.meta {
+  color: #a3a3a3;
+  font-size: clamp(12px, 1vw + 6px, 16px);
+  white-space: nowrap;
+}
+.actions {
+  display: flex;
+  justify-content: space-between;
+  align-items: center;
+  margin-top: clamp(8px, 1.2vw, 16px);
+}
+.btn {
+  appearance: none;
+  border: 1px solid #2a2a2a;
+  background: #141414;
+  color: #f2f2f2;
+  padding: 8px 12px;
+  font-size: clamp(12px, 1vw + 6px, 16px);
+  border-radius: 6px;
+  cursor: pointer;
+}
+.btn:hover { background: #1b1b1b; }
+table {
+  border-collapse: collapse;
+  width: 100%;
+  font-size: clamp(12px, 1.4vw + 8px, 30px);
+  table-layout: fixed;
+}
+th, td {
+  text-align: left;
+  padding: clamp(8px, 1.2vw, 16px) clamp(10px, 1.6vw, 22px);
+  border-bottom: 1px solid #2a2a2a;
+  line-height: 1.2;
+}
+th {
+  background: #333;
+  text-align: center;
+  font-family: "Slackey", "Mystery Quest", cursive;
+  font-weight: 400;
+  font-size: clamp(14px, 1.8vw + 8px, 36px);
+}
+th.group, td.group { border-left: 2px solid #222222; }
+th.time, td.time { text-align: right; }
+.col-baby { width: 17%; }
+.col-feed-type { width: 19%; }
+.col-feed-time { width: 26%; }
+.col-diaper-type { width: 12%; }
+.col-diaper-time { width: 26%; }
+""".lstrip()
+
+
+PAGE_SCRIPT = """
+let lastSuccessMs = Date.now();
+let staleActive = false;
+
+function openCleanWindow() {
+  const features = "toolbar=no,location=no,menubar=no,scrollbars=yes,resizable=yes";
+  window.open(window.location.href, "nara_clean", features);
+}
+
+function updateStaleNote() {
+  const meta = document.querySelector(".meta");
+  if (!meta) {
+    return;
+  }
+  if (!meta.dataset.base) {
+    meta.dataset.base = meta.textContent || "";
+  }
+  if (!staleActive) {
+    meta.textContent = meta.dataset.base;
+    return;
+  }
+  const minutes = Math.max(0, Math.floor((Date.now() - lastSuccessMs) / 60000));
+  if (minutes === 0) {
+    meta.textContent = meta.dataset.base;
+    return;
+  }
+  const suffix = minutes === 1 ? "1 min old" : `${minutes} mins old`;
+  meta.textContent = `${meta.dataset.base} (${suffix})`;
+}
+
+async function refreshContent() {
+  try {
+    const response = await fetch(window.location.href, { cache: "no-cache" });
+    if (!response.ok) {
+      staleActive = true;
+      updateStaleNote();
+      console.warn("Refresh failed", response.status);
+      return;
     }
-    th {
-      background: #333;
-      text-align: center;
-      font-family: "Slackey", "Mystery Quest", cursive;
-      font-weight: 400;
-      font-size: clamp(14px, 1.8vw + 8px, 36px);
+    const htmlText = await response.text();
+    const parsed = new DOMParser().parseFromString(htmlText, "text/html");
+    const nextContainer = parsed.querySelector(".container");
+    const container = document.querySelector(".container");
+    if (container && nextContainer) {
+      container.innerHTML = nextContainer.innerHTML;
+      lastSuccessMs = Date.now();
+      staleActive = false;
+      updateStaleNote();
+    } else {
+      staleActive = true;
+      updateStaleNote();
+      console.warn("Refresh failed: missing container");
     }
-    th.group, td.group { border-left: 2px solid #222222; }
-    th.time, td.time { text-align: right; }
-    .col-baby { width: 17%; }
-    .col-feed-type { width: 19%; }
-    .col-feed-time { width: 26%; }
-    .col-diaper-type { width: 12%; }
-    .col-diaper-time { width: 26%; }
-    """.strip()
-    script = """
-    let lastSuccessMs = Date.now();
-    let staleActive = false;
+  } catch (err) {
+    staleActive = true;
+    updateStaleNote();
+    console.warn("Refresh error", err);
+  }
+}
 
-    function openCleanWindow() {
-      const features = "toolbar=no,location=no,menubar=no,scrollbars=yes,resizable=yes";
-      window.open(window.location.href, "nara_clean", features);
-    }
+function formatRelative(ms, nowMs) {
+  if (ms === null || ms === undefined || ms === "") {
+    return "unknown";
+  }
+  const delta = Math.floor(Math.max(0, nowMs - Number(ms)) / 1000);
+  const mins = Math.floor(delta / 60);
+  const hours = Math.floor(mins / 60);
+  const days = Math.floor(hours / 24);
+  const parts = [];
+  if (days) {
+    parts.push(`${days} day` + (days !== 1 ? "s" : ""));
+  }
+  if (hours % 24) {
+    parts.push(`${hours % 24} hour` + (hours % 24 !== 1 ? "s" : ""));
+  }
+  if (mins % 60 && !days) {
+    parts.push(`${mins % 60} minute` + (mins % 60 !== 1 ? "s" : ""));
+  }
+  if (!parts.length) {
+    return "just now";
+  }
+  return parts.join(" ") + " ago";
+}
 
-    function updateStaleNote() {
-      const meta = document.querySelector(".meta");
-      if (!meta) {
-        return;
-      }
-      if (!meta.dataset.base) {
-        meta.dataset.base = meta.textContent || "";
-      }
-      if (!staleActive) {
-        meta.textContent = meta.dataset.base;
-        return;
-      }
-      const minutes = Math.max(0, Math.floor((Date.now() - lastSuccessMs) / 60000));
-      if (minutes === 0) {
-        meta.textContent = meta.dataset.base;
-        return;
+function timeColors(ms, nowMs) {
+  if (ms === null || ms === undefined || ms === "") {
+    return ["#333333", "#f2f2f2"];
+  }
+  const deltaHours = Math.max(0, nowMs - Number(ms)) / 3600000;
+  const stops = [
+    [1.0, [27, 94, 32]],
+    [2.0, [133, 100, 18]],
+    [3.0, [121, 69, 0]],
+    [4.0, [122, 28, 28]],
+  ];
+  let rgb = stops[stops.length - 1][1];
+  if (deltaHours <= 1.0) {
+    rgb = stops[0][1];
+  } else if (deltaHours < 4.0) {
+    for (let i = 0; i < stops.length - 1; i++) {
+      const [h0, c0] = stops[i];
+      const [h1, c1] = stops[i + 1];
+      if (deltaHours <= h1) {
+        const t = (deltaHours - h0) / (h1 - h0);
+        rgb = c0.map((c, j) => Math.round(c + (c1[j] - c) * t));
+        break;
       }
-      const suffix = minutes === 1 ? "1 min old" : `${minutes} mins old`;
-      meta.textContent = `${meta.dataset.base} (${suffix})`;
     }
+  }
+  return ["#" + rgb.map((c) => c.toString(16).padStart(2, "0")).join(""), "#ffffff"];
+}
 
-    async function refreshContent() {
-      try {
-        const url = new URL(window.location.href);
-        url.searchParams.set("_", Date.now().toString());
-        const response = await fetch(url, { cache: "no-store" });
-        if (!response.ok) {
-          staleActive = true;
-          updateStaleNote();
-          console.warn("Refresh failed", response.status);
-          return;
-        }
-        const htmlText = await response.text();
-        const parsed = new DOMParser().parseFromString(htmlText, "text/html");
-        const nextContainer = parsed.querySelector(".container");
-        const container = document.querySelector(".container");
-        if (container && nextContainer) {
-          container.innerHTML = nextContainer.innerHTML;
-          lastSuccessMs = Date.now();
-          staleActive = false;
-          updateStaleNote();
-        } else {
-          staleActive = true;
-          updateStaleNote();
-          console.warn("Refresh failed: missing container");
-        }
-      } catch (err) {
-        staleActive = true;
-        updateStaleNote();
-        console.warn("Refresh error", err);
-      }
+function setTime(cell, begin, nowMs) {
+  cell.dataset.begin = begin === null || begin === undefined ? "" : String(begin);
+  const [bg, fg] = timeColors(cell.dataset.begin, nowMs);
+  cell.textContent = formatRelative(cell.dataset.begin, nowMs);
+  cell.style.background = bg;
+  cell.style.color = fg;
+}
+
+function updateTimes() {
+  const nowMs = Date.now();
+  document.querySelectorAll("td.time[data-begin]").forEach((cell) => {
+    setTime(cell, cell.dataset.begin, nowMs);
+  });
+}
+
+function setText(cell, text) {
+  if (cell && cell.textContent !== text) {
+    cell.textContent = text;
+  }
+}
+
+function applyPayload(payload) {
+  const rows = Array.from(document.querySelectorAll("tr[data-child]"));
+  const ids = payload.children.map((child) => child.id);
+  if (rows.length !== ids.length || rows.some((row, i) => row.dataset.child !== ids[i])) {
+    refreshContent();
+    return;
+  }
+  const nowMs = Date.now();
+  payload.children.forEach((child, i) => {
+    const row = rows[i];
+    const cell = (field) => row.querySelector(`[data-field="${field}"]`);
+    setText(cell("name"), child.vitaminsToday ? `${child.name} \\u{1F48A}` : child.name);
+    setText(cell("feed-label"), child.feed.label);
+    setText(cell("diaper-label"), child.diaper.label);
+    setTime(cell("feed-time"), child.feed.beginDt, nowMs);
+    setTime(cell("diaper-time"), child.diaper.beginDt, nowMs);
+  });
+  const meta = document.querySelector(".meta");
+  if (meta) {
+    const d = new Date(payload.generatedAt);
+    const pad = (n) => String(n).padStart(2, "0");
+    const generated = `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())} ${pad(d.getHours())}:${pad(d.getMinutes())}`;
+    meta.dataset.base = `as of ${generated}` + (payload.stale ? " (stale)" : "");
+  }
+  lastSuccessMs = nowMs;
+  staleActive = false;
+  updateStaleNote();
+}
+
+let eventsConnected = false;
+
+function connectEvents() {
+  if (!window.EventSource) {
+    return;
+  }
+  const source = new EventSource("/events");
+  source.onopen = () => {
+    eventsConnected = true;
+  };
+  source.onmessage = (event) => {
+    try {
+      applyPayload(JSON.parse(event.data));
+    } catch (err) {
+      console.warn("Event error", err);
+      refreshContent();
     }
+  };
+  source.onerror = () => {
+    eventsConnected = false;
+  };
+}
 
-    setInterval(refreshContent, 60000);
-    """.strip()
+connectEvents();
+setInterval(() => {
+  if (eventsConnected) {
+    updateTimes();
+  } else {
+    refreshContent();
+  }
+}, 60000);
+""".lstrip()
+
+
+def static_path(name, body):
+    stem, ext = name.rsplit(".", 1)
+    return f"/static/{stem}.{hashlib.sha1(body.encode('utf-8')).hexdigest()[:12]}.{ext}"
+
+
+# Content-addressed, so they can be cached forever.
+PAGE_CSS_PATH = static_path("nara.css", PAGE_CSS)
+PAGE_SCRIPT_PATH = static_path("nara.js", PAGE_SCRIPT)
+
+
+def build_html(latest_feed, latest_diaper, child_map, generated_at, body_class="", vitamins=None, is_stale=False):
+    body_html = build_body(latest_feed, latest_diaper, child_map, generated_at, vitamins, is_stale)
     return f"""<!doctype html>
 <html>
 <head>
@@ -425,25 +627,19 @@ def build_html(latest_feed, latest_diaper, child_map, generated_at, body_class="
   <meta name="viewport" content="width=device-width, initial-scale=1" />
   <title>Nara Feeds</title>
   <link rel="icon" href="/favicon.svg" type="image/svg+xml" />
-  <style>
-    {css}
-  </style>
+  <link rel="stylesheet" href="{PAGE_CSS_PATH}" />
 </head>
 <body class="{html.escape(body_class)}">
   <div class="container">
     {body_html}
   </div>
-  <script>
-    {script}
-  </script>
+  <script src="{PAGE_SCRIPT_PATH}"></script>
 </body>
 </html>
 """
 
 
-
-
-def build_json(latest_feed, latest_diaper, child_map, generated_at, vitamins=None):
+def build_json(latest_feed, latest_diaper, child_map, generated_at, vitamins=None, is_stale=False):
     if vitamins is None:
         vitamins = {}
     child_keys = sorted(
@@ -462,153 +658,945 @@ def build_json(latest_feed, latest_diaper, child_map, generated_at, vitamins=Non
                 "vitaminsToday": bool(vitamins.get(child_key)),
                 "feed": {
                     "label": feed_label(feed_ev) if feed_ev else "unknown",
-                    "beginDt": feed_ev.get("beginDt") if feed_ev else None,
+                    "beginDt": feed_ev.begin_dt if feed_ev else None,
                 },
                 "diaper": {
                     "label": diaper_label(diaper_ev) if diaper_ev else "unknown",
-                    "beginDt": diaper_ev.get("beginDt") if diaper_ev else None,
+                    "beginDt": diaper_ev.begin_dt if diaper_ev else None,
                 },
             }
         )
     return {
         "generatedAt": generated_at,
+        "stale": is_stale,
         "children": children,
     }
 
 
-class NaraServer(HTTPServer):
+def make_etag(*parts, weak=False):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part)
+    tag = f'"{digest.hexdigest()[:20]}"'
+    return "W/" + tag if weak else tag
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag[2:] if etag.startswith("W/") else etag
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == bare:
+            return True
+    return False
+
+
+COMPRESS_MIN_SIZE = 512
+
+
+def compress_variants(body, best=False):
+    # Preferred first: brotli when the module is installed, then gzip.
+    if len(body) < COMPRESS_MIN_SIZE:
+        return {}
+    variants = {}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=11 if best else 5)
+    variants["gzip"] = gzip.compress(body, 9 if best else 6)
+    return variants
+
+
+def choose_encoding(header, codings):
+    accepted = {}
+    for item in (header or "").split(","):
+        name, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in codings:
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class Rendered:
+    # One response body plus its compressed variants, compressed once up
+    # front so serving it is a header check and a write.
+    def __init__(self, content_type, body, etag, cache_control="no-cache"):
+        self.content_type = content_type
+        self.body = body
+        self.etag = etag
+        self.cache_control = cache_control
+        self.variants = compress_variants(body, best=cache_control != "no-cache")
+
+    def encoded(self, accept_encoding):
+        encoding = choose_encoding(accept_encoding, self.variants)
+        if encoding is None:
+            return self.body, None
+        return self.variants[encoding], encoding
+
+
+STATIC_MAX_AGE = "public, max-age=31536000, immutable"
+STATIC_FILES = {
+    PAGE_CSS_PATH: Rendered("text/css; charset=utf-8", PAGE_CSS.encode("utf-8"), make_etag(PAGE_CSS.encode("utf-8")), STATIC_MAX_AGE),
+    PAGE_SCRIPT_PATH: Rendered("text/javascript; charset=utf-8", PAGE_SCRIPT.encode("utf-8"), make_etag(PAGE_SCRIPT.encode("utf-8")), STATIC_MAX_AGE),
+}
+
+
+class JsonHistory:
+    # The last few distinct /json contents, each with the generatedAt range
+    # it was served under, so /json?since= can answer with just the
+    # children that changed since a generatedAt or ETag the client has.
+    def __init__(self, size=32):
+        self.states = deque(maxlen=size)
+        self.lock = threading.Lock()
+
+    def record(self, payload, etag):
+        generated_at = payload["generatedAt"]
+        with self.lock:
+            state = self.states[-1] if self.states else None
+            if state is not None and state["etag"] == etag:
+                state["first"] = min(state["first"], generated_at)
+                state["last"] = max(state["last"], generated_at)
+                return
+            children = {child["id"]: child for child in payload["children"]}
+            self.states.append({"first": generated_at, "last": generated_at, "etag": etag, "children": children})
+
+    def find(self, since):
+        since = since.strip()
+        tag = since.removeprefix("W/").strip('"')
+        with self.lock:
+            for state in reversed(self.states):
+                if since.isdigit():
+                    if state["first"] <= int(since) <= state["last"]:
+                        return state
+                elif state["etag"].removeprefix("W/").strip('"') == tag:
+                    return state
+        return None
+
+
+class Snapshot:
+    def __init__(self, data, refreshed_at, duration, index):
+        self.data = data
+        self.refreshed_at = refreshed_at
+        self.duration = duration
+        self.index = index
+
+    def age(self, now=None):
+        if now is None:
+            now = time.time()
+        return max(0.0, now - self.refreshed_at)
+
+
+class Device:
+    # One emulator or phone: its own local copies, collector, snapshot and
+    # refresh schedule, so a slow or offline device only delays itself.
+    def __init__(self, name, adb_device, nara_db, firebase_db, collector, adb_client=None, schedule=None):
+        self.name = name
+        self.adb_device = adb_device
+        self.adb_client = adb_client
+        self.nara_db = nara_db
+        self.firebase_db = firebase_db
+        self.collector = collector
+        self.remote_signatures = {}
+        self.history_signature = None
+        # Held by the history sync while it reads the database, and by a
+        # query-mode refresh while it writes the mirror; pulled copies are
+        # double-buffered instead.
+        self.history_lock = threading.Lock()
+        self.schedule = schedule or RefreshSchedule(10.0)
+        self.failures = 0
+        self.snapshot = None
+        self.refresh_error = None
+        self.refresh_lock = threading.Lock()
+        self.refresh_finished_at = 0.0
+        self.ready = threading.Event()
+        self.wake = threading.Event()
+
+    def next_delay(self, max_backoff, active=False):
+        if not self.failures:
+            return self.schedule.next_delay(active)
+        interval = self.schedule.interval
+        return min(interval * 2 ** min(self.failures, 32), max(max_backoff, interval))
+
+
+class NaraServer(ThreadingHTTPServer):
+    daemon_threads = True
+
     adb_path: str
-    adb_device: Optional[str]
-    nara_db_path: Path
-    firebase_db_path: Path
+    source: str
+    devices: List[Device]
     cache_ttl: float
-    cache_data: Optional[Dict[str, Any]]
-    cache_time: float
+    max_backoff: float
+    last_demand_at: float
+    snapshot: Optional[Snapshot]
+    snapshot_ready: threading.Event
+    refresh_error: Optional[str]
+    merge_lock: threading.Lock
+    merged_from: Tuple[Any, ...]
+    background_refresh: bool
+    snapshot_changed: threading.Condition
+    snapshot_version: int
+    event_streams: int
+    max_event_streams: int
+    render_lock: threading.Lock
+    render_key: Optional[Tuple[Snapshot, bool, int]]
+    rendered: Dict[Tuple[str, str], Rendered]
+    favicon: Optional[Tuple[Tuple[int, int], Rendered]]
+    keepalive_timeout: float
+    json_history: JsonHistory
+    history: Optional[HistoryStore]
+    history_wake: threading.Event
+
+
+def refresh_device(server, device, requested_at=None):
+    with device.refresh_lock:
+        # Single-flight: callers that queued behind a refresh which finished
+        # after they asked reuse its result instead of pulling again.
+        if requested_at is not None and device.refresh_finished_at >= requested_at:
+            if device.refresh_error is not None:
+                raise RuntimeError(device.refresh_error)
+            return device.snapshot
+
+        start = time.time()
+        try:
+            with REFRESH_SECONDS.time(phase=server.source, device=device.name):
+                if server.source == "query":
+                    with device.history_lock:
+                        sync_remote_db(server.adb_path, device.nara_db, device.adb_device)
+                else:
+                    pull_databases(
+                        server.adb_path,
+                        [(REMOTE_NARA_DB, device.nara_db), (REMOTE_FIREBASE_DB, device.firebase_db)],
+                        device.adb_device,
+                        device.remote_signatures,
+                        device.adb_client,
+                    )
+            with reading(device.nara_db, device.firebase_db) as (nara_db_path, firebase_db_path):
+                with REFRESH_SECONDS.time(phase="collect", device=device.name):
+                    data = device.collector.collect(nara_db_path, firebase_db_path)
+        except Exception as exc:
+            device.refresh_error = str(exc) or exc.__class__.__name__
+            merge_snapshots(server)
+            raise
+        finally:
+            device.refresh_finished_at = time.time()
+        previous = device.snapshot
+        if previous is not None and previous.data.get("events") is data.get("events"):
+            index = previous.index
+        else:
+            index = build_index(data.get("events", []))
+        end = device.refresh_finished_at
+        # Swap in a complete snapshot with a single assignment so readers never
+        # see data from one refresh paired with timing from another.
+        device.snapshot = Snapshot(data, end, end - start, index)
+        device.refresh_error = None
+    merge_snapshots(server)
+    history_wake = getattr(server, "history_wake", None)
+    if history_wake is not None:
+        history_wake.set()
+    return device.snapshot
+
+
+def sync_history(server, device):
+    # The collector only sees the --since window, so the history follows
+    # the database file itself.  It only backs /history and /aggregates, so
+    # a failed sync is retried after the next refresh.
+    try:
+        with device.history_lock, reading(device.nara_db) as (nara_db_path,):
+            signature = file_signature(nara_db_path)
+            if signature == device.history_signature:
+                return
+            with REFRESH_SECONDS.time(phase="history", device=device.name):
+                server.history.sync(nara_db_path, device.name)
+            device.history_signature = signature
+    except Exception:
+        logging.exception("History sync failed for %s", device.name)
+
+
+def history_loop(server):
+    # Syncs after refreshes publish their snapshots, so importing into the
+    # history store never holds up /json or /events.
+    while True:
+        server.history_wake.wait()
+        server.history_wake.clear()
+        for device in server.devices:
+            if device.snapshot is not None:
+                sync_history(server, device)
+
+
+def start_history_sync(server):
+    thread = threading.Thread(target=history_loop, args=(server,), name="nara-history", daemon=True)
+    thread.start()
+    return thread
+
+
+def merge_indexes(indexes):
+    merged = {"FEED": {}, "DIAPER": {}, "vitamins": {}}
+    for index in indexes:
+        for group in ("FEED", "DIAPER"):
+            latest = merged[group]
+            for child_key, ev in index[group].items():
+                current = latest.get(child_key)
+                if current is None or (ev.begin_dt or 0) > (current.begin_dt or 0):
+                    latest[child_key] = ev
+        vitamins = merged["vitamins"]
+        for child_key, begin in index["vitamins"].items():
+            vitamins[child_key] = max(begin, vitamins.get(child_key, begin))
+    return merged
+
+
+def merge_snapshots(server):
+    # Publishes the combined view of every device's latest snapshot.  With
+    # one device that is its snapshot as is; otherwise the per-child indexes
+    # are merged, and only rebuilt when one of them changed.
+    with server.merge_lock:
+        devices = server.devices
+        errors = [device for device in devices if device.refresh_error is not None]
+        was_stale = server.refresh_error is not None
+        if len(devices) == 1:
+            server.refresh_error = devices[0].refresh_error
+        else:
+            server.refresh_error = "; ".join(f"{device.name}: {device.refresh_error}" for device in errors) or None
+        snapshots = [device.snapshot for device in devices if device.snapshot is not None]
+        previous = server.snapshot
+        if not snapshots:
+            snapshot = None
+        elif len(devices) == 1:
+            snapshot = snapshots[0]
+        else:
+            merged_from = tuple(s.index for s in snapshots)
+            if previous is not None and len(merged_from) == len(server.merged_from) and all(
+                a is b for a, b in zip(merged_from, server.merged_from)
+            ):
+                index = previous.index
+            else:
+                index = merge_indexes(merged_from)
+            server.merged_from = merged_from
+            data = {
+                "generatedAt": min(s.data.get("generatedAt", 0) for s in snapshots),
+                "familyKeys": [key for s in snapshots for key in s.data.get("familyKeys", [])],
+                "children": {k: v for s in snapshots for k, v in s.data.get("children", {}).items()},
+                "users": {k: v for s in snapshots for k, v in s.data.get("users", {}).items()},
+            }
+            snapshot = Snapshot(
+                data,
+                min(s.refreshed_at for s in snapshots),
+                max(s.duration for s in snapshots),
+                index,
+            )
+        server.snapshot = snapshot
+        is_stale = server.refresh_error is not None
+        changed = snapshot is not None and (previous is None or snapshot.index is not previous.index)
+    if changed or is_stale != was_stale:
+        notify_snapshot(server)
+
+
+def refresh_live_data(server, requested_at=None):
+    # Refreshes every device in parallel; fails only when none has data.
+    devices = server.devices
+    if len(devices) == 1:
+        refresh_device(server, devices[0], requested_at)
+        return server.snapshot
+    errors = []
+    with ThreadPoolExecutor(max_workers=len(devices)) as pool:
+        futures = [pool.submit(refresh_device, server, device, requested_at) for device in devices]
+        for device, future in zip(devices, futures):
+            try:
+                future.result()
+            except Exception as exc:
+                logging.warning("Refresh failed for %s: %s", device.name, exc)
+                errors.append(exc)
+    if server.snapshot is None and errors:
+        raise errors[0]
+    return server.snapshot
+
+
+def notify_snapshot(server):
+    changed = getattr(server, "snapshot_changed", None)
+    if changed is None:
+        return
+    with changed:
+        server.snapshot_version += 1
+        changed.notify_all()
+
+
+def refresh_loop(server, device):
+    while True:
+        try:
+            refresh_device(server, device)
+            device.failures = 0
+            device.schedule.record(device.collector.changed)
+        except Exception:
+            device.failures += 1
+            logging.exception("Background refresh failed for %s", device.name)
+        finally:
+            # Requests wait for the first data from any device, or for every
+            # device to have tried once, so a slow one can't hold up the rest.
+            device.ready.set()
+            if device.snapshot is not None or all(d.ready.is_set() for d in server.devices):
+                server.snapshot_ready.set()
+        active = server.event_streams > 0 or time.time() - server.last_demand_at < DEMAND_WINDOW
+        delay = device.next_delay(server.max_backoff, active)
+        REFRESH_DELAY.set(delay, device=device.name)
+        if device.failures:
+            time.sleep(delay)
+            continue
+        # A client asking for data older than the base interval cuts an
+        # idle wait short, but never below the minimum interval.
+        device.wake.clear()
+        device.wake.wait(delay)
+        remaining = device.schedule.min_interval - (time.time() - device.refresh_finished_at)
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+def start_refresher(server):
+    server.background_refresh = True
+    threads = []
+    for device in server.devices:
+        thread = threading.Thread(
+            target=refresh_loop,
+            args=(server, device),
+            name=f"nara-refresh-{device.name}",
+            daemon=True,
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
 
 
 def fetch_live_data(server):
-    now = time.time()
-    cache_data = getattr(server, "cache_data", None)
-    cache_time = getattr(server, "cache_time", 0.0)
-    cache_ttl = getattr(server, "cache_ttl", 0.0)
-    if cache_data is not None and cache_ttl > 0 and (now - cache_time) < cache_ttl:
-        return cache_data, False
+    server.last_demand_at = time.time()
+    if getattr(server, "background_refresh", False):
+        server.snapshot_ready.wait()
+        snapshot = server.snapshot
+        SNAPSHOT_CACHE.inc(result="hit")
+        for device in server.devices:
+            if device.snapshot is None or device.snapshot.age() >= device.schedule.interval:
+                device.wake.set()
+    else:
+        snapshot = getattr(server, "snapshot", None)
+        cache_ttl = getattr(server, "cache_ttl", 0.0)
+        hit = snapshot is not None and cache_ttl > 0 and snapshot.age() < cache_ttl
+        SNAPSHOT_CACHE.inc(result="hit" if hit else "miss")
+        if not hit:
+            try:
+                snapshot = refresh_live_data(server, time.time())
+            except Exception:
+                if snapshot is None:
+                    raise
+                logging.exception("Refresh failed; serving stale data")
+    if snapshot is None:
+        raise RuntimeError(f"No data available: {server.refresh_error or 'refresh pending'}")
+    is_stale = server.refresh_error is not None
+    return snapshot, is_stale
+
+
+def render_json(snapshot, is_stale, history=None, base=None):
+    index = snapshot.index
+    payload = build_json(
+        index["FEED"],
+        index["DIAPER"],
+        snapshot.data.get("children", {}),
+        snapshot.data.get("generatedAt", int(time.time() * 1000)),
+        vitamins_since(index["vitamins"]),
+        is_stale,
+    )
+    # generatedAt advances on every refresh even when nothing was logged,
+    # so the (weak) validator only covers the content; clients read the
+    # "as of" time of a 304 from X-Nara-Generated-At instead.
+    content = json.dumps([payload["stale"], payload["children"]], separators=(",", ":"))
+    etag = make_etag(content.encode("utf-8"), weak=True)
+    if history is not None:
+        history.record(payload, etag)
+    if base is not None:
+        ids = {child["id"] for child in payload["children"]}
+        payload = dict(
+            payload,
+            since=base["last"],
+            children=[child for child in payload["children"] if base["children"].get(child["id"]) != child],
+            removed=[child_id for child_id in base["children"] if child_id not in ids],
+        )
+    body_bytes = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return Rendered("application/json; charset=utf-8", body_bytes, etag)
+
+
+def render_html(snapshot, is_stale, side=""):
+    index = snapshot.index
+    data = snapshot.data
+    html_body = build_html(
+        index["FEED"],
+        index["DIAPER"],
+        data.get("children", {}),
+        data.get("generatedAt", int(time.time() * 1000)),
+        "bottom" if side == "bottom" else "",
+        vitamins_since(index["vitamins"]),
+        is_stale,
+    )
+    body_bytes = html_body.encode("utf-8")
+    return Rendered("text/html; charset=utf-8", body_bytes, make_etag(body_bytes))
+
+
+def cached_render(server, snapshot, is_stale, kind, variant=""):
+    # Output only changes with the snapshot or when the relative times tick
+    # over, so each (snapshot, minute, kind, variant) is rendered just once.
+    # The variant is the page side for HTML and the ?since= base for JSON;
+    # an unknown base falls back to the full payload.
+    history = getattr(server, "json_history", None)
+    base = None
+    if kind == "json":
+        base = history.find(variant) if variant and history is not None else None
+        variant = base["etag"] if base is not None else ""
+    key = (snapshot, is_stale, int(time.time() // 60))
+    with server.render_lock:
+        if server.render_key != key:
+            server.render_key = key
+            server.rendered = {}
+        rendered = server.rendered.get((kind, variant))
+    RENDER_CACHE.inc(kind=kind, result="miss" if rendered is None else "hit")
+    if rendered is None:
+        with RENDER_SECONDS.time(kind=kind):
+            if kind == "json":
+                rendered = render_json(snapshot, is_stale, history, base)
+            else:
+                rendered = render_html(snapshot, is_stale, variant)
+        with server.render_lock:
+            if server.render_key == key:
+                server.rendered[(kind, variant)] = rendered
+    return rendered
+
+
+# SQLite integers are signed 64-bit; larger query parameters overflow.
+SQL_INT_RANGE = range(-(2**63), 2**63)
+
+
+def sql_int(number, value):
+    if number not in SQL_INT_RANGE:
+        raise ValueError(f"out of range: {value!r}")
+    return number
+
 
-    adb_pull(server.adb_path, REMOTE_NARA_DB, server.nara_db_path, server.adb_device)
-    adb_pull(server.adb_path, REMOTE_FIREBASE_DB, server.firebase_db_path, server.adb_device)
-    data = collect_live_data(server.nara_db_path, server.firebase_db_path)
-    server.cache_data = data
-    server.cache_time = now
-    return data, False
+def parse_time_param(value, now_ms=None):
+    # Epoch milliseconds, or a duration back from now ("7d").
+    value = value.strip()
+    if value.isdigit():
+        return sql_int(int(value), value)
+    duration = parse_duration(value)
+    if duration is None:
+        return None
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    return sql_int(now_ms - duration, value)
+
+
+def history_label(ev):
+    if ev.track_group_key == "FEED":
+        return feed_label(ev)
+    if ev.track_group_key == "DIAPER":
+        return diaper_label(ev)
+    return ev.payload.get("routineName") or ev.track_type_key
+
+
+def render_history(history, snapshot, params):
+    # One page of stored events, newest first.  "next" is the cursor for
+    # the following page: the beginDt and key of this page's last event.
+    def param(name):
+        return params.get(name, [""])[0]
+
+    try:
+        start = parse_time_param(param("from"))
+        end = parse_time_param(param("to"))
+        limit = int(param("limit") or HISTORY_PAGE_SIZE)
+    except ValueError as exc:
+        raise ValueError(f"invalid parameter: {exc}") from None
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    before = None
+    cursor = param("cursor")
+    if cursor:
+        begin, _, key = cursor.partition(":")
+        if not begin.lstrip("-").isdigit() or not key:
+            raise ValueError(f"invalid cursor: {cursor!r}")
+        before = (sql_int(int(begin), begin), key)
+    group = param("group").upper() or None
+
+    events = history.query(param("child") or None, group, start, end, before, limit)
+    data = snapshot.data if snapshot is not None else {}
+    child_map = data.get("children", {})
+    user_map = data.get("users", {})
+    last = events[-1] if len(events) == limit else None
+    payload = {
+        "events": [dict(ev.to_dict(child_map, user_map), label=history_label(ev)) for ev in events],
+        "next": f"{last.begin_dt}:{last.key}" if last is not None and last.begin_dt is not None else None,
+    }
+    body_bytes = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return Rendered("application/json; charset=utf-8", body_bytes, make_etag(body_bytes))
+
+
+def render_aggregates(history, snapshot, params):
+    # Per-child, per-local-day totals from the store's daily cache.
+    def param(name):
+        return params.get(name, [""])[0]
+
+    try:
+        start = parse_time_param(param("from"))
+        end = parse_time_param(param("to"))
+    except ValueError as exc:
+        raise ValueError(f"invalid parameter: {exc}") from None
+    child_map = snapshot.data.get("children", {}) if snapshot is not None else {}
+    days = history.daily(param("child") or None, start, end)
+    payload = {"days": [dict(day, childName=child_map.get(day["childKey"])) for day in days]}
+    body_bytes = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return Rendered("application/json; charset=utf-8", body_bytes, make_etag(body_bytes))
 
 
 class Handler(BaseHTTPRequestHandler):
+    # Keep-alive: every response carries a Content-Length (or closes the
+    # connection), and idle sockets time out so they can't pin a thread.
+    # Headers and body are separate writes, so Nagle's algorithm would hold
+    # the body back for the client's delayed ACK on a reused connection.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        self.timeout = getattr(self.server, "keepalive_timeout", None) or None
+        super().setup()
+
+    def send_empty(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def favicon(self):
+        server = cast(NaraServer, self.server)
+        icon_path = Path(__file__).resolve().parent / "favicon.svg"
+        try:
+            stat = icon_path.stat()
+        except FileNotFoundError:
+            return None
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = server.favicon
+        if cached is None or cached[0] != signature:
+            data = icon_path.read_bytes()
+            cached = (signature, Rendered("image/svg+xml", data, make_etag(data), "public, max-age=86400"))
+            server.favicon = cached
+        return cached[1]
+
+    def send_snapshot_headers(self, snapshot, is_stale):
+        self.send_header("X-Nara-Snapshot-Age", f"{snapshot.age():.3f}")
+        if "generatedAt" in snapshot.data:
+            self.send_header("X-Nara-Generated-At", str(snapshot.data["generatedAt"]))
+        self.send_header("X-Nara-Refresh-Duration", f"{snapshot.duration:.3f}")
+        self.send_header("X-Nara-Stale", "1" if is_stale else "0")
+
+    def send_rendered(self, rendered, snapshot=None, is_stale=False):
+        body_bytes, encoding = rendered.encoded(self.headers.get("Accept-Encoding"))
+        # Encoded bodies differ byte-for-byte, so a strong validator needs
+        # its own tag per encoding.
+        etag = rendered.etag
+        if encoding and not etag.startswith("W/"):
+            etag = etag[:-1] + "-" + encoding + '"'
+        not_modified = etag_matches(self.headers.get("If-None-Match"), etag)
+        self.send_response(304 if not_modified else 200)
+        if not not_modified:
+            self.send_header("Content-Type", rendered.content_type)
+            self.send_header("Content-Length", str(len(body_bytes)))
+            if encoding:
+                self.send_header("Content-Encoding", encoding)
+        if rendered.variants:
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", rendered.cache_control)
+        if snapshot is not None:
+            self.send_snapshot_headers(snapshot, is_stale)
+        self.end_headers()
+        if not not_modified:
+            self.wfile.write(body_bytes)
+
+    def send_text(self, code, text):
+        msg = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Content-Length", str(len(msg)))
+        self.end_headers()
+        self.wfile.write(msg)
+
+    def send_history(self, kind, params):
+        # Served from the local history store and whatever names the last
+        # snapshot had; never waits for a refresh.
+        server = cast(NaraServer, self.server)
+        history = server.history
+        if history is None or (kind == "aggregates" and not history.aggregates):
+            self.send_empty(404)
+            return
+        render = render_aggregates if kind == "aggregates" else render_history
+        try:
+            with RENDER_SECONDS.time(kind=kind):
+                rendered = render(history, server.snapshot, params)
+        except ValueError as exc:
+            self.send_text(400, f"Error: {exc}")
+            return
+        self.send_rendered(rendered)
+
+    def send_metrics(self):
+        server = cast(NaraServer, self.server)
+        snapshot = server.snapshot
+        SNAPSHOT_AGE.set(snapshot.age() if snapshot is not None else None)
+        EVENTS_IN_MEMORY.set(sum(len(device.collector.events) for device in server.devices))
+        EVENT_STREAMS.set(server.event_streams)
+        body_bytes = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body_bytes)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+    def stream_events(self):
+        server = cast(NaraServer, self.server)
+        with server.snapshot_changed:
+            if server.event_streams >= server.max_event_streams:
+                full = True
+            else:
+                full = False
+                server.event_streams += 1
+        if full:
+            msg = b"Too many event streams"
+            self.send_response(503)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+            self.send_header("Content-Length", str(len(msg)))
+            self.send_header("Retry-After", "60")
+            self.end_headers()
+            self.wfile.write(msg)
+            return
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.send_header("Connection", "close")
+            self.close_connection = True
+            self.end_headers()
+            last_etag = None
+            while True:
+                version = server.snapshot_version
+                snapshot, is_stale = fetch_live_data(server)
+                rendered = cached_render(server, snapshot, is_stale, "json")
+                if rendered.etag != last_etag:
+                    self.wfile.write(b"data: " + rendered.body + b"\n\n")
+                    last_etag = rendered.etag
+                else:
+                    self.wfile.write(b": keepalive\n\n")
+                self.wfile.flush()
+                # Wake on a new snapshot, or periodically to keep the
+                # connection alive and notice the vitamin reset at midnight.
+                with server.snapshot_changed:
+                    server.snapshot_changed.wait_for(lambda: server.snapshot_version != version, timeout=15)
+        except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
+            return
+        except Exception:
+            logging.exception("Event stream failed")
+        finally:
+            with server.snapshot_changed:
+                server.event_streams -= 1
+
     def do_GET(self):
         parsed = urlparse(self.path)
         if parsed.path == "/favicon.svg":
-            icon_path = Path(__file__).resolve().parent / "favicon.svg"
-            if not icon_path.exists():
-                self.send_response(404)
-                self.end_headers()
+            icon = self.favicon()
+            if icon is None:
+                self.send_empty(404)
                 return
-            data = icon_path.read_bytes()
-            self.send_response(200)
-            self.send_header("Content-Type", "image/svg+xml")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
+            self.send_rendered(icon)
             return
-        if parsed.path not in ("/", "/index.html", "/json"):
-            self.send_response(404)
-            self.end_headers()
+        if parsed.path in STATIC_FILES:
+            self.send_rendered(STATIC_FILES[parsed.path])
+            return
+        if parsed.path == "/events":
+            self.stream_events()
+            return
+        if parsed.path == "/metrics":
+            self.send_metrics()
+            return
+        if parsed.path not in ("/", "/index.html", "/json", "/history", "/aggregates"):
+            self.send_empty(404)
             return
 
         try:
-            server = cast(NaraServer, self.server)
-            data, is_stale = fetch_live_data(server)
-            latest_feed = latest_by_group(data.get("events", []), "FEED")
-            latest_diaper = latest_by_group(data.get("events", []), "DIAPER")
-            generated_at = data.get("generatedAt", int(time.time() * 1000))
-            vitamins = vitamins_today(data.get("events", []))
-            if parsed.path == "/json":
-                payload = build_json(
-                    latest_feed,
-                    latest_diaper,
-                    data.get("children", {}),
-                    generated_at,
-                    vitamins,
-                )
-                body_bytes = json.dumps(payload, separators=(",", ":")).encode("utf-8")
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json; charset=utf-8")
-                self.send_header("Cache-Control", "no-store")
-                self.send_header("Content-Length", str(len(body_bytes)))
-                self.end_headers()
-                self.wfile.write(body_bytes)
+            if parsed.path in ("/history", "/aggregates"):
+                self.send_history(parsed.path[1:], parse_qs(parsed.query))
                 return
-
+            server = cast(NaraServer, self.server)
+            snapshot, is_stale = fetch_live_data(server)
             params = parse_qs(parsed.query)
-            side = params.get("side", [""])[0]
-            body_class = "bottom" if side == "bottom" else ""
-            html_body = build_html(
-                latest_feed,
-                latest_diaper,
-                data.get("children", {}),
-                generated_at,
-                body_class,
-                vitamins,
-            )
-            body_bytes = html_body.encode("utf-8")
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.send_header("Content-Length", str(len(body_bytes)))
-            self.end_headers()
-            self.wfile.write(body_bytes)
+            if parsed.path == "/json":
+                rendered = cached_render(server, snapshot, is_stale, "json", params.get("since", [""])[0])
+            else:
+                side = params.get("side", [""])[0]
+                rendered = cached_render(server, snapshot, is_stale, "html", "bottom" if side == "bottom" else "")
+            self.send_rendered(rendered, snapshot, is_stale)
         except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
             return
         except Exception as exc:
             logging.exception("Request failed for %s", self.path)
-            msg = f"Error: {exc}".encode("utf-8")
             try:
-                self.send_response(500)
-                self.send_header("Content-Type", "text/plain; charset=utf-8")
-                self.send_header("Content-Length", str(len(msg)))
-                self.end_headers()
-                self.wfile.write(msg)
+                self.send_text(500, f"Error: {exc}")
             except (ConnectionAbortedError, ConnectionResetError, BrokenPipeError):
                 return
 
 
+def parse_device(value):
+    # "serial" or "serial@interval", e.g. "emulator-5556@60s".
+    serial, _, interval = value.strip().partition("@")
+    interval_ms = parse_duration(interval) if interval else None
+    return serial or None, interval_ms / 1000 if interval_ms else None
+
+
+def make_server(
+    host,
+    port,
+    db_dir,
+    adb_path="adb",
+    adb_devices=(None,),
+    source="pull",
+    adb_socket=False,
+    since_ms=None,
+    cache_ttl=10.0,
+    history_path=None,
+):
+    db_dir = Path(db_dir)
+    db_dir.mkdir(exist_ok=True)
+    min_interval = float(os.environ.get("NARA_MIN_INTERVAL", "2"))
+    max_interval = float(os.environ.get("NARA_MAX_INTERVAL", "300"))
+
+    devices = []
+    for spec in adb_devices or (None,):
+        serial, interval = spec if isinstance(spec, tuple) else (spec, None)
+        name = serial or "default"
+        # One device keeps the historical layout; several get a directory each.
+        device_dir = db_dir if len(adb_devices or ()) <= 1 else db_dir / re.sub(r"[^\w.-]", "_", name)
+        device_dir.mkdir(exist_ok=True)
+        if source == "query":
+            nara_db = firebase_db = device_dir / "nara_mirror.db"
+        else:
+            nara_db = LocalDbSlots(device_dir / "nara.db", TRACKZ_INDEXES)
+            firebase_db = LocalDbSlots(device_dir / "amazing-ripple-221320.firebaseio.com_default")
+        devices.append(
+            Device(
+                name,
+                serial,
+                nara_db,
+                firebase_db,
+                LiveCollector(since_ms=since_ms),
+                AdbSyncClient(serial) if adb_socket else None,
+                RefreshSchedule(interval or cache_ttl, min_interval, max_interval),
+            )
+        )
+
+    server = NaraServer((host, port), Handler)
+    server.adb_path = adb_path
+    server.source = source
+    server.devices = devices
+    server.cache_ttl = cache_ttl
+    server.max_backoff = float(os.environ.get("NARA_MAX_BACKOFF", "300"))
+    server.last_demand_at = 0.0
+    server.snapshot = None
+    server.snapshot_ready = threading.Event()
+    server.refresh_error = None
+    server.merge_lock = threading.Lock()
+    server.merged_from = ()
+    server.background_refresh = False
+    server.snapshot_changed = threading.Condition()
+    server.snapshot_version = 0
+    server.event_streams = 0
+    server.max_event_streams = int(os.environ.get("NARA_MAX_EVENT_STREAMS", "32"))
+    server.render_lock = threading.Lock()
+    server.render_key = None
+    server.rendered = {}
+    server.favicon = None
+    server.json_history = JsonHistory(int(os.environ.get("NARA_JSON_HISTORY", "32")))
+    server.keepalive_timeout = float(os.environ.get("NARA_KEEPALIVE_TIMEOUT", "30"))
+    server.history = HistoryStore(db_dir / history_path) if history_path else None
+    server.history_wake = threading.Event()
+    return server
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--adb-path", dest="adb_path", default=os.environ.get("ADB_PATH", "adb"))
     parser.add_argument(
         "--adb-device",
-        dest="adb_device",
-        default=os.environ.get("ADB_DEVICE") or os.environ.get("ANDROID_SERIAL"),
+        dest="adb_devices",
+        action="append",
+        type=parse_device,
+        help="device serial, optionally with its own refresh interval (serial@60s); repeat for several devices",
+    )
+    parser.add_argument(
+        "--source",
+        dest="source",
+        choices=("pull", "query"),
+        default=os.environ.get("NARA_SOURCE", "pull"),
+        help="pull whole database files, or query changed rows on the device with sqlite3",
+    )
+    parser.add_argument(
+        "--adb-socket",
+        dest="adb_socket",
+        action="store_true",
+        default=bool(os.environ.get("NARA_ADB_SOCKET")),
+        help="pull over persistent adb server connections instead of running adb for each pull",
+    )
+    parser.add_argument(
+        "--since",
+        dest="since",
+        type=parse_duration,
+        default=os.environ.get("NARA_SINCE", "48h"),
+        help="history to load (e.g. 48h, or 'all'); the latest event per child and group is always kept",
+    )
+    parser.add_argument(
+        "--history",
+        dest="history",
+        default=os.environ.get("NARA_HISTORY", "nara_history.db"),
+        help="SQLite file (in nara_device_db) that keeps every pulled event for /history; empty to disable",
     )
     parser.add_argument("--host", dest="host", default="127.0.0.1")
     parser.add_argument("--port", dest="port", type=int, default=8787)
     args = parser.parse_args()
+    if not args.adb_devices:
+        serials = os.environ.get("ADB_DEVICE") or os.environ.get("ANDROID_SERIAL") or ""
+        args.adb_devices = [parse_device(serial) for serial in serials.split(",") if serial.strip()] or [(None, None)]
 
     base_dir = Path(__file__).resolve().parent.relative_to(os.getcwd())
-    db_dir = base_dir / "nara_device_db"
-    db_dir.mkdir(exist_ok=True)
-
-    nara_db_path = db_dir / "nara.db"
-    firebase_db_path = db_dir / "amazing-ripple-221320.firebaseio.com_default"
-
-    server = NaraServer((args.host, args.port), Handler)
-    server.adb_path = args.adb_path
-    server.adb_device = args.adb_device
-    server.nara_db_path = nara_db_path
-    server.firebase_db_path = firebase_db_path
-    server.cache_ttl = float(os.environ.get("NARA_CACHE_TTL", "10"))
-    server.cache_data = None
-    server.cache_time = 0.0
+    server = make_server(
+        args.host,
+        args.port,
+        base_dir / "nara_device_db",
+        args.adb_path,
+        args.adb_devices,
+        args.source,
+        args.adb_socket,
+        args.since,
+        float(os.environ.get("NARA_CACHE_TTL", "10")),
+        args.history,
+    )
 
     print(f"Serving on http://{args.host}:{args.port}")
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if server.history is not None:
+        start_history_sync(server)
+    if server.cache_ttl > 0:
+        start_refresher(server)
     server.serve_forever()
 
 